@@ -0,0 +1,111 @@
+from collections import deque
+
+# ---------------- CUMULATIVE ACKS ----------------
+# An ACK names the newest snapshot id the client has fully received plus a
+# 32-bit mask for the ACK_WINDOW ids before it (bit i set = latest - 1 - i was
+# received too). Every ACK repeats the recent history, so losing some ACKs
+# loses no information, and the client can send them less often or piggyback
+# them on EVENT packets.
+#
+#   AckWindow    - client side, folds received ids into (latest, bits)
+#   LossTracker  - server side, turns a client's ACKs into a loss picture of the
+#                  snapshots sent to it
+#   RttEstimator - server side, smoothed RTT from ACKs of fresh snapshots
+
+ACK_WINDOW = 32
+ACK_MASK = (1 << ACK_WINDOW) - 1
+LOSS_HISTORY = 200  # snapshots the recent loss rate is computed over
+
+
+def acked_ids(latest, bits):
+    yield latest
+    for i in range(ACK_WINDOW):
+        if bits >> i & 1:
+            yield latest - 1 - i
+
+
+def hold_ms(state, now):
+    # How long the newest id of an AckWindow state has waited for its ACK, so
+    # the server can take it out of its RTT sample
+    return min(65535, int((now - state[2]) * 1000))
+
+
+class AckWindow:
+    def __init__(self):
+        # One attribute so other threads always read a consistent tuple
+        self.state = None  # (latest, bits, time latest arrived) or None before anything arrived
+
+    def record(self, snapshot_id, now):
+        if self.state is None:
+            self.state = (snapshot_id, 0, now)
+            return
+        latest, bits, at = self.state
+        if snapshot_id > latest:
+            shift = snapshot_id - latest
+            bits = ((bits << shift) | (1 << (shift - 1))) & ACK_MASK if shift <= ACK_WINDOW else 0
+            self.state = (snapshot_id, bits, now)
+        elif 0 < latest - snapshot_id <= ACK_WINDOW:
+            self.state = (latest, bits | 1 << (latest - snapshot_id - 1), at)
+
+
+class LossTracker:
+    def __init__(self, history=LOSS_HISTORY):
+        self.pending = deque()  # ids sent to the client whose fate is not known yet
+        self.seen = set()
+        self.outcomes = deque(maxlen=history)  # 1 = received, 0 = lost, oldest first
+        self.received = 0
+        self.lost = 0
+
+    def on_sent(self, snapshot_id):
+        self.pending.append(snapshot_id)
+
+    def on_ack(self, latest, bits):
+        if not self.pending:
+            return
+        oldest = self.pending[0]
+        for sid in acked_ids(latest, bits):
+            if sid >= oldest:
+                self.seen.add(sid)
+        # Settled in send order: reported as received, or slid out of the ACK
+        # window without being reported
+        while self.pending and (self.pending[0] in self.seen or self.pending[0] < latest - ACK_WINDOW):
+            self._finalize(self.pending.popleft())
+
+    def _finalize(self, sid):
+        ok = sid in self.seen
+        self.seen.discard(sid)
+        self.outcomes.append(1 if ok else 0)
+        if ok:
+            self.received += 1
+        else:
+            self.lost += 1
+
+    def loss_rate(self):
+        # Fraction of the last LOSS_HISTORY settled snapshots that never arrived
+        if not self.outcomes:
+            return 0.0
+        return 1.0 - sum(self.outcomes) / len(self.outcomes)
+
+
+class RttEstimator:
+    # SRTT / RTTVAR smoothing as in RFC 6298
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.min_rtt = None  # path delay without queueing
+        self.samples = 0
+
+    def sample(self, rtt):
+        if rtt < 0:
+            return
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        self.samples += 1
+
+    def rto(self):
+        # Time after which a missing answer is overdue
+        return self.srtt + 4 * self.rttvar
@@ -0,0 +1,229 @@
+import argparse
+import io
+import os
+import re
+import sys
+import numpy as np
+import pandas as pd
+
+# ---------------- SCENARIO ANALYSIS ----------------
+# Compares recorded runs without a notebook cell per folder. Every directory
+# under the given roots that holds client_metrics CSVs is a scenario (the
+# recorded Baseline / Delay100ms / Loss_2% / Loss_5% folders, or what
+# `test.py --scenario` collected into runs/), whatever its file prefix and
+# however many clients it has. All client CSVs are read into one frame with
+# `scenario` and `client` columns, so every statistic below is one groupby
+# instead of a loop over files:
+#   per client    latency / jitter / error percentiles, on-time %, bandwidth
+#   per scenario  the same over all rows of all its clients, plus server CPU
+#   verdicts      each scenario against the baseline, metric by metric
+#
+#   python analyze_metrics.py
+#   python analyze_metrics.py runs --baseline runs/Baseline --strict
+
+CLIENT_FILE = re.compile(r"client_metrics_(\d+)\.csv$")  # not client_render_metrics
+SERVER_FILE = re.compile(r"(^|_)server_metrics\.csv$")  # the Metric,Value summary
+CLIENT_COLUMNS = ["time_since_start_ms", "latency_ms", "jitter_ms", "perceived_position_error",
+                  "bandwidth_per_client_kbps", "rtt_ms"]
+SERVER_VALUES = {"Average CPU %": "cpu_avg_pct", "Max CPU %": "cpu_max_pct"}
+QUANTILES = (0.5, 0.95, 0.99)
+DEADLINE_MS = 200  # an update later than this counts as not delivered in time
+SKIP_DIRS = {"__pycache__", "Old", ".git"}
+
+# Metrics a scenario is judged on: (column, higher is worse, smallest change
+# that counts). The floor keeps a 0.3 ms -> 0.4 ms baseline wobble from being
+# a "33 % regression".
+CHECKS = [
+    ("latency_p95_ms", True, 5.0),
+    ("latency_p99_ms", True, 5.0),
+    ("jitter_p95_ms", True, 2.0),
+    ("error_p95", True, 1.0),
+    ("on_time_pct", False, 1.0),
+    ("bandwidth_kbps", True, 2.0),
+]
+
+
+# ---------------- LOADING ----------------
+def find_scenarios(roots):
+    # {scenario name: {"clients": {client id: path}, "server": path or None}}
+    scenarios = {}
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS)
+            clients = {}
+            for name in filenames:
+                match = CLIENT_FILE.search(name)
+                if match:
+                    clients[int(match.group(1))] = os.path.join(dirpath, name)
+            if not clients or os.path.abspath(dirpath) == os.path.abspath(root) and root == ".":
+                continue  # the working directory's own CSVs are a run still in progress
+            server = next((os.path.join(dirpath, n) for n in sorted(filenames) if SERVER_FILE.search(n)), None)
+            scenarios[os.path.relpath(dirpath)] = {"clients": clients, "server": server}
+    return scenarios
+
+def load_clients(scenarios):
+    # One frame for every client of every scenario. pandas costs about as much
+    # per read_csv call as per thousand rows, so files sharing a header are
+    # joined into one buffer and parsed in a single call; each row's scenario
+    # and client come from the line counts of the files it was joined from.
+    groups = {}  # header -> (bodies, line counts, scenario of each file, client of each file)
+    for scenario, files in scenarios.items():
+        for client, path in sorted(files["clients"].items()):
+            with open(path, "rb") as f:
+                header, _, body = f.read().partition(b"\n")
+            if body and not body.endswith(b"\n"):
+                body += b"\n"
+            group = groups.setdefault(header.strip(), ([], [], [], []))
+            for items, value in zip(group, (body, body.count(b"\n"), scenario, client)):
+                items.append(value)
+    frames = []
+    categories = list(scenarios)
+    for header, (bodies, counts, names, clients) in groups.items():
+        frame = pd.read_csv(io.BytesIO(header + b"\n" + b"".join(bodies)), skip_blank_lines=False,
+                            usecols=lambda c: c in CLIENT_COLUMNS)
+        codes = np.repeat([categories.index(name) for name in names], counts)
+        frame.insert(0, "scenario", pd.Categorical.from_codes(codes, categories))
+        frame.insert(1, "client", np.repeat(clients, counts))
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=["scenario", "client"] + CLIENT_COLUMNS)
+    frame = pd.concat(frames, ignore_index=True)
+    frame["scenario"] = frame["scenario"].astype(pd.CategoricalDtype(categories))  # concat drops it on mismatch
+    for column in CLIENT_COLUMNS:
+        if column not in frame:
+            frame[column] = float("nan")
+    return frame
+
+def load_servers(scenarios):
+    rows = []
+    for scenario, files in scenarios.items():
+        row = {"scenario": scenario}
+        if files["server"]:
+            values = pd.read_csv(files["server"]).set_index("Metric")["Value"]
+            for metric, column in SERVER_VALUES.items():
+                row[column] = pd.to_numeric(values.get(metric), errors="coerce")
+        rows.append(row)
+    return pd.DataFrame(rows, columns=["scenario"] + list(SERVER_VALUES.values())).set_index("scenario")
+
+
+# ---------------- STATISTICS ----------------
+def split_rows(frame):
+    # Update rows vs the summary row a client appends when its session ends
+    update = frame["time_since_start_ms"].notna()
+    return frame[update], frame[~update]
+
+def _percentiles(grouped, column, name, unit=""):
+    table = grouped[column].quantile(list(QUANTILES)).unstack()
+    table.columns = [f"{name}_p{round(q * 100)}{unit}" for q in QUANTILES]
+    return table
+
+def _summarize(rows, sessions, keys):
+    rows = rows.assign(on_time_pct=rows["latency_ms"].le(DEADLINE_MS) * 100.0)
+    grouped = rows.groupby(keys, sort=False, observed=True)
+    table = pd.concat([
+        grouped.size().rename("updates"),
+        grouped["latency_ms"].mean().rename("latency_mean_ms"),
+        _percentiles(grouped, "latency_ms", "latency", "_ms"),
+        _percentiles(grouped, "jitter_ms", "jitter", "_ms"),
+        grouped["perceived_position_error"].mean().rename("error_mean"),
+        _percentiles(grouped, "perceived_position_error", "error"),
+        grouped["on_time_pct"].mean(),
+        grouped["rtt_ms"].median().rename("rtt_p50_ms"),
+    ], axis=1)
+    # Session bandwidth from the summary row; the mean of the streamed values
+    # for clients that never wrote one
+    per_client = sessions.groupby(["scenario", "client"], observed=True)["bandwidth_per_client_kbps"].last()
+    streamed = rows.groupby(["scenario", "client"], observed=True)["bandwidth_per_client_kbps"].mean()
+    bandwidth = per_client.combine_first(streamed)
+    if keys == ["scenario"]:
+        bandwidth = bandwidth.groupby(level="scenario", observed=True).mean()
+    return table.join(bandwidth.rename("bandwidth_kbps"))
+
+def client_summary(frame):
+    rows, sessions = split_rows(frame)
+    return _summarize(rows, sessions, ["scenario", "client"])
+
+def scenario_summary(frame, servers=None):
+    rows, sessions = split_rows(frame)
+    table = _summarize(rows, sessions, ["scenario"])
+    table.insert(0, "clients", frame.groupby("scenario", sort=False, observed=True)["client"].nunique())
+    if servers is not None:
+        table = table.join(servers)
+    return table
+
+def verdicts(summary, baseline, checks=CHECKS, tolerance=0.10):
+    # (scenario, metric, baseline value, value, change %, verdict) for every
+    # scenario but the baseline; a change must pass both the relative
+    # tolerance and the metric's absolute floor to count
+    if baseline not in summary.index:
+        raise KeyError(f"baseline scenario {baseline!r} not found")
+    base = summary.loc[baseline]
+    out = []
+    for scenario, row in summary.drop(index=baseline).iterrows():
+        for metric, higher_is_worse, floor in checks:
+            before, after = base.get(metric), row.get(metric)
+            if pd.isna(before) or pd.isna(after):
+                continue
+            change = after - before
+            significant = abs(change) >= floor and abs(change) > tolerance * abs(before)
+            worse = change > 0 if higher_is_worse else change < 0
+            verdict = ("REGRESSED" if worse else "improved") if significant else "ok"
+            out.append({"scenario": scenario, "metric": metric, "baseline": round(before, 3), "value": round(after, 3),
+                        "change_pct": round(100 * change / before, 1) if before else float("inf"), "verdict": verdict})
+    return pd.DataFrame(out, columns=["scenario", "metric", "baseline", "value", "change_pct", "verdict"])
+
+
+# ---------------- REPORT ----------------
+def order_scenarios(table, baseline):
+    # The baseline first, the rest by name
+    names = sorted(table.index.get_level_values("scenario").unique(), key=lambda s: (s != baseline, s))
+    return table.reindex(names, level="scenario") if table.index.nlevels > 1 else table.reindex(names)
+
+def pick_baseline(names, requested=None):
+    if requested is not None:
+        return requested
+    return next((n for n in names if os.path.basename(n).lower() == "baseline"), None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare Grid Clash scenario runs against a baseline")
+    parser.add_argument("roots", nargs="*", default=["."], help="directories searched for scenario folders")
+    parser.add_argument("--baseline", help="scenario the others are judged against (default: the folder named Baseline)")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="relative change that counts (0.10 = 10%%)")
+    parser.add_argument("--per-client", action="store_true", help="also print the per-client table")
+    parser.add_argument("--csv", help="save the per-scenario table here")
+    parser.add_argument("--clients-csv", help="save the per-client table here")
+    parser.add_argument("--strict", action="store_true", help="exit with status 1 when any metric regressed")
+    args = parser.parse_args()
+
+    scenarios = find_scenarios(args.roots)
+    if not scenarios:
+        print("No scenario folders with client_metrics CSVs found")
+        sys.exit(1)
+    frame = load_clients(scenarios)
+    baseline = pick_baseline(list(scenarios), args.baseline)
+    summary = order_scenarios(scenario_summary(frame, load_servers(scenarios)), baseline)
+    print(f"{len(scenarios)} scenarios, {sum(len(f['clients']) for f in scenarios.values())} clients, "
+          f"{len(frame)} rows\n")
+    with pd.option_context("display.max_columns", None, "display.width", 200, "display.precision", 2):
+        print(summary.T.to_string())
+        if args.per_client:
+            print()
+            print(order_scenarios(client_summary(frame), baseline).to_string())
+    if args.csv:
+        summary.to_csv(args.csv)
+    if args.clients_csv:
+        order_scenarios(client_summary(frame), baseline).to_csv(args.clients_csv)
+
+    if baseline is None:
+        print("\nNo baseline scenario, skipping verdicts (use --baseline)")
+        sys.exit(0)
+    results = verdicts(summary, baseline, tolerance=args.tolerance)
+    print(f"\nAgainst {baseline} (tolerance {args.tolerance:.0%}):")
+    for scenario, rows in results.groupby("scenario", sort=False):
+        regressed = rows[rows["verdict"] == "REGRESSED"]
+        print(f"  {scenario}: {'REGRESSED ' + ', '.join(regressed['metric']) if len(regressed) else 'no regressions'}")
+        for _, r in rows[rows["verdict"] != "ok"].iterrows():
+            print(f"      {r['metric']:<16} {r['baseline']:>10} -> {r['value']:<10} {r['change_pct']:+.1f}%  {r['verdict']}")
+    if args.strict and (results["verdict"] == "REGRESSED").any():
+        sys.exit(1)
@@ -0,0 +1,90 @@
+import random
+import timeit
+import argparse
+from grid_encoding import ENCODING_NAMES, encode_cells, encode_with, decode_cells, pack_changes, unpack_changes
+from protocol import Packet, CODEC_BINARY, encode_packet, decode_packet
+
+# ---------------- GRID ENCODING BENCHMARK ----------------
+# Size and client-side decode time of every cell encoding on typical boards,
+# plus the full binary SNAPSHOT/DELTA decode the client does per packet.
+#   python bench_encoding.py [--size 20] [--seed 1]
+
+
+def make_boards(size, rng):
+    cells = size * size
+    rows_claimed = bytearray()
+    for r in range(size):
+        rows_claimed += bytes([r % 4 + 1]) * size if r < size // 2 else bytes(size)
+    return {
+        "empty": bytes(cells),
+        "half, row runs": bytes(rows_claimed),
+        "half, scattered": bytes(rng.randint(1, 4) if rng.random() < 0.5 else 0 for _ in range(cells)),
+        "full, scattered": bytes(rng.randint(1, 4) for _ in range(cells)),
+    }
+
+def make_deltas(size, rng):
+    def scattered(n):
+        picked = rng.sample(range(size * size), min(n, size * size))
+        return [[i // size, i % size, rng.randint(1, 4)] for i in picked]
+    return {"1 tick (4 cells)": scattered(4), "1 tick (40 cells)": scattered(40),
+            "catch-up (400 cells)": scattered(400)}
+
+def per_call_us(fn, repeat=200):
+    return min(timeit.repeat(fn, number=repeat, repeat=3)) / repeat * 1e6
+
+def bench_cells(boards):
+    print(f"{'board':<18}{'encoding':<9}{'bytes':>8}{'decode us':>11}")
+    for name, cells in boards.items():
+        chosen = encode_cells(cells)[0]
+        for encoding in ENCODING_NAMES:
+            data = encode_with(encoding, cells)
+            if data is None:
+                continue
+            us = per_call_us(lambda: decode_cells(encoding, data, len(cells)))
+            mark = " <" if encoding == chosen else ""
+            print(f"{name:<18}{ENCODING_NAMES[encoding]:<9}{len(data):>8}{us:>11.1f}{mark}")
+    print("(< = picked by the server)\n")
+
+def bench_packets(size, boards, deltas):
+    print(f"{'packet':<30}{'cell bytes':>11}{'encoded':>9}{'decode us':>11}")
+    for name, cells in boards.items():
+        grid = [list(cells[r * size:(r + 1) * size]) for r in range(size)]
+        payload = {"Message": "Live Update", "Grid": grid, "gameOngoing": True}
+        _report(f"SNAPSHOT {name}", "SNAPSHOT", payload, size * size)
+    for name, changes in deltas.items():
+        payload = {"Changes": changes, "Base": 0, "gameOngoing": True}
+        _report(f"DELTA {name}", "DELTA", payload, 2 + 5 * len(changes))
+    print()
+
+def _report(label, msg_type, payload, raw_cells):
+    data = encode_packet(Packet(1, msg_type, 1, 1, 0.0, 0, payload), CODEC_BINARY)
+    us = per_call_us(lambda: decode_packet(data), repeat=50)
+    print(f"{label:<30}{raw_cells:>11}{len(data):>9}{us:>11.1f}")
+
+def check_roundtrip(boards, deltas):
+    for cells in boards.values():
+        encoding, data = encode_cells(cells)
+        assert decode_cells(encoding, data, len(cells)) == cells
+    for changes in deltas.values():
+        decoded, _ = unpack_changes(pack_changes(changes), 0)
+        assert sorted(decoded) == sorted(changes)
+        if changes:
+            # A cell repeated in one list decodes once, with its last value
+            r, c, v = changes[0]
+            decoded, _ = unpack_changes(pack_changes(changes + [[r, c, v % 4 + 1]]), 0)
+            assert sorted(decoded) == sorted(changes[1:] + [[r, c, v % 4 + 1]])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grid encoding size / decode benchmark")
+    parser.add_argument("--size", type=int, default=20, help="board side in cells")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    boards = make_boards(args.size, rng)
+    deltas = make_deltas(args.size, rng)
+    check_roundtrip(boards, deltas)
+    print(f"Board {args.size}x{args.size}\n")
+    bench_cells(boards)
+    bench_packets(args.size, boards, deltas)
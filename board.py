@@ -0,0 +1,100 @@
+try:
+    import numpy as np
+except ImportError:  # the pure-bytes path below needs nothing extra
+    np = None
+
+# ---------------- GAME BOARD ----------------
+# The board lives in one flat row-major buffer of uint8 cell values
+# (0 = free, 1..4 = owning player). Snapshots are immutable `bytes` copies of
+# that buffer, so archiving a tick is a single memcpy instead of a deepcopy of
+# GRID_SIZE lists of Python ints.
+
+# Chunk width for the pure-Python diff: equal chunks are skipped with a single
+# C-level bytes comparison, only differing chunks are scanned cell by cell.
+DIFF_CHUNK = 64
+
+
+class GameBoard:
+    def __init__(self, rows, cols=None):
+        self.rows = rows
+        self.cols = cols if cols is not None else rows
+        if np is not None:
+            self.cells = np.zeros(self.rows * self.cols, dtype=np.uint8)
+        else:
+            self.cells = bytearray(self.rows * self.cols)
+        self.version = 0  # bumped on every write so callers can skip idle ticks
+
+    def __len__(self):
+        return self.rows * self.cols
+
+    def index(self, r, c):
+        return r * self.cols + c
+
+    def coords(self, idx):
+        return divmod(int(idx), self.cols)
+
+    def in_bounds(self, r, c):
+        return 0 <= r < self.rows and 0 <= c < self.cols
+
+    def get(self, r, c):
+        return int(self.cells[r * self.cols + c])
+
+    def set(self, r, c, value):
+        self.cells[r * self.cols + c] = value
+        self.version += 1
+
+    def snapshot(self):
+        if np is not None:
+            return self.cells.tobytes()
+        return bytes(self.cells)
+
+    def to_rows(self, snapshot=None):
+        # Nested lists for the JSON "Grid" payload
+        data = snapshot if snapshot is not None else self.snapshot()
+        cols = self.cols
+        return [list(data[r * cols:(r + 1) * cols]) for r in range(self.rows)]
+
+    def clamp_rect(self, r0, c0, h, w, max_side):
+        # Clip a requested (r0, c0, h, w) viewport to the board and to max_side
+        r0 = min(max(0, r0), self.rows - 1)
+        c0 = min(max(0, c0), self.cols - 1)
+        h = max(1, min(h, max_side, self.rows - r0))
+        w = max(1, min(w, max_side, self.cols - c0))
+        return (r0, c0, h, w)
+
+    def region_rows(self, snapshot, rect):
+        # Nested lists for a "Grid" patch covering rect = (r0, c0, h, w)
+        r0, c0, h, w = rect
+        cols = self.cols
+        return [list(snapshot[(r0 + r) * cols + c0:(r0 + r) * cols + c0 + w]) for r in range(h)]
+
+    def changes(self, old, new):
+        # [r, c, v] triples for the "Changes" payload
+        return self.to_changes(*diff_snapshots(old, new))
+
+    def to_changes(self, indices, values):
+        cols = self.cols
+        return [[int(i) // cols, int(i) % cols, int(v)] for i, v in zip(indices, values)]
+
+
+def diff_snapshots(old, new):
+    # (indices, values) of the cells of `new` that differ from `old`
+    if old == new:
+        return [], []
+    if np is not None:
+        a = np.frombuffer(old, dtype=np.uint8)
+        b = np.frombuffer(new, dtype=np.uint8)
+        idx = np.flatnonzero(a != b)
+        return idx, b[idx]
+
+    idx, vals = [], []
+    for start in range(0, len(new), DIFF_CHUNK):
+        end = start + DIFF_CHUNK
+        a, b = old[start:end], new[start:end]
+        if a == b:
+            continue
+        for i, (x, y) in enumerate(zip(a, b)):
+            if x != y:
+                idx.append(start + i)
+                vals.append(y)
+    return idx, vals
@@ -1,162 +1,364 @@
 import tkinter as tk
 from tkinter import messagebox
 import socket
-import json
 import threading
 import datetime
-import csv
 import time
+import argparse
+from game_client import GameClient, GRID_SIZE
+from client_metrics import MetricsWriter, RollingHistogram, WindowedRate
+from protocol import RECV_BUFFER, MAX_EVENT_MOVES, hello_message
 
 SERVER_NAME = 'localhost'
 SERVER_PORT = 12000
 
-GRID_SIZE = 20
 CELL_SIZE = 30
+MAX_CANVAS = 600  # cells shrink so large boards still fit on screen
+VIEW_SIDE = 64  # larger boards are shown through a viewport panned with the arrow keys
+VIEWPORT_RESEND = 0.25  # seconds between VIEWPORT retries until the server confirms it
+HELLO_RETRY = 1.0  # a lost Hello or lobby reply is repeated until the server assigns an id
+MOVE_WINDOW_MS = 30  # clicks within this window go out as one EVENT (0 = send every click)
+PREDICTION_TIMEOUT = 1.0  # seconds before an unanswered predicted cell is rolled back
+RENDER_FPS = 30  # cap on canvas repaints per second, however fast updates arrive
+STATS_INTERVAL = 0.5  # seconds between refreshes of the live latency label
+METRICS_FIELDS = ["snapshot_id", "seq_num", "time_since_start_ms", "timestamp_epoch_ms", "latency_ms", "jitter_ms",
+                  "perceived_position_error", "mispredictions", "rollback_latency_ms", "bandwidth_per_client_kbps",
+                  "rtt_ms", "clock_offset_ms"]
+RENDER_FIELDS = ["time_since_start_s", "render_ms", "cells_painted", "packets_merged"]
 PLAYER_COLORS = {
     0: "#FFFFFF", 1: "#FF0000", 2: "#0000FF", 3: "#FFFF00", 4: "#00FF00"
 }
 
-class Packet:
-    def __init__(self, version, msg_type, snapshot_id, seq_num, server_timestamp, payload_len, payload):
-        self.version = version
-        self.msg_type = msg_type
-        self.snapshot_id = snapshot_id
-        self.seq_num = seq_num
-        self.server_timestamp = server_timestamp
-        self.payload_len = payload_len
-        self.payload = payload
-
 class GridClashGUI:
-    def __init__(self, root):
+    def __init__(self, root, move_window_ms=MOVE_WINDOW_MS):
         self.root = root
         self.root.title("Grid Clash: Delta Client")
         
-        self.local_grid = [[0]*GRID_SIZE for _ in range(GRID_SIZE)]
-        self.grid_rects = [[None]*GRID_SIZE for _ in range(GRID_SIZE)]
+        # Handshake, board state and ACKs live in the headless client; the
+        # network thread is the only one writing its grid
+        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.net = GameClient(self.send_datagram)
+        self.grid_rects = {}  # (r, c) -> canvas rect, only for cells inside the view
+        self.view = (0, 0, GRID_SIZE, GRID_SIZE)
+        self.view_pending = False  # VIEWPORT sent but no region snapshot seen yet
+        self.view_sent_at = 0
+        self.cell_px = CELL_SIZE
+        self.move_window_ms = move_window_ms
+        self.pending_moves = []  # cells clicked since the last EVENT, in click order
+        self.flush_scheduled = False
+        # Client-side prediction: cells painted on click before the server
+        # confirms them, (r, c) -> click time. local_grid stays authoritative.
+        self.predicted = {}
+        self.prediction_lock = threading.Lock()
+        # Render loop: the network thread merges updates into `dirty`
+        # ((r, c) -> value) and one callback per frame paints the net result
+        self.dirty = {}
+        self.pending_status = None
+        self.dirty_lock = threading.Lock()
+        self.render_scheduled = False
+        self.last_render = 0
+        self.packets_since_render = 0
         
         self.canvas = tk.Canvas(root, width=CELL_SIZE*GRID_SIZE, height=CELL_SIZE*GRID_SIZE)
         self.canvas.pack(pady=10)
+        self.canvas.bind("<B1-Motion>", self.on_drag)  # drag-painting claims every cell passed over
         self.status_label = tk.Label(root, text="Connecting...", font=("Helvetica", 14))
         self.status_label.pack(pady=5)
         self.lbl_ping = tk.Label(root, text="Ping: 0ms")
         self.lbl_ping.pack(pady=5)
+        self.lbl_stats = tk.Label(root, text="")  # live p50/p99 of the last few seconds
+        self.lbl_stats.pack()
         
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.my_id = None
         self.running = True
         self.create_grid()
         
         # --- METRICS ---
-        self.metrics_log = [] 
+        # Rows stream to client_metrics_<id>.csv / client_render_metrics_<id>.csv
+        # in flushed batches once the id is known; the live figures are
+        # rolling, so memory stays flat however long the session runs
+        self.metrics = MetricsWriter(METRICS_FIELDS)
+        self.render_metrics = MetricsWriter(RENDER_FIELDS)
+        self.latency_hist = RollingHistogram()
+        self.jitter_hist = RollingHistogram()
+        self.bandwidth = WindowedRate()
+        self.last_stats = 0
         self.previous_latency = 0
         self.start_time = None 
         self.bandwidth_start_time = None
         self.total_bytes_received = 0
-        self.seq_ID = 0
-        self.snapshotId = 0
+        self.mispredictions = 0
+        self.rollback_ms_total = 0.0
         
         threading.Thread(target=self.listen_to_server, daemon=True).start()
         self.connect_to_server()
         
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.bind("<Left>", lambda e: self.pan(0, -1))
+        self.root.bind("<Right>", lambda e: self.pan(0, 1))
+        self.root.bind("<Up>", lambda e: self.pan(-1, 0))
+        self.root.bind("<Down>", lambda e: self.pan(1, 0))
 
     def create_grid(self):
-        for r in range(GRID_SIZE):
-            for c in range(GRID_SIZE):
-                x1, y1 = c*CELL_SIZE, r*CELL_SIZE
-                x2, y2 = x1+CELL_SIZE, y1+CELL_SIZE
-                rect = self.canvas.create_rectangle(x1, y1, x2, y2, fill="white", outline="gray")
-                self.grid_rects[r][c] = rect
+        r0, c0, h, w = self.view
+        cell = self.cell_px = max(2, min(CELL_SIZE, MAX_CANVAS // max(h, w)))
+        self.canvas.delete("all")
+        self.canvas.config(width=cell*w, height=cell*h)
+        self.grid_rects = {}
+        for r in range(r0, r0 + h):
+            for c in range(c0, c0 + w):
+                x1, y1 = (c - c0)*cell, (r - r0)*cell
+                x2, y2 = x1+cell, y1+cell
+                fill = PLAYER_COLORS.get(self.display_value(r, c, self.local_grid[r][c]), "white")
+                rect = self.canvas.create_rectangle(x1, y1, x2, y2, fill=fill, outline="gray")
+                self.grid_rects[(r, c)] = rect
                 self.canvas.tag_bind(rect, "<Button-1>", lambda e, x=r, y=c: self.send_move(x, y))
 
+    # --- VIEWPORT (area of interest on boards larger than VIEW_SIDE) ---
+    @property
+    def rows(self):
+        return self.net.rows
+
+    @property
+    def cols(self):
+        return self.net.cols
+
+    @property
+    def local_grid(self):
+        return self.net.grid
+
+    @property
+    def my_id(self):
+        return self.net.my_id
+
+    def on_board_size(self, rows, cols):
+        # The headless client has already made a fresh grid of the new size
+        with self.dirty_lock:
+            self.dirty.clear()
+        self.view = (0, 0, min(rows, VIEW_SIDE), min(cols, VIEW_SIDE))
+        if self.view[2:] != (rows, cols):
+            self.send_viewport()
+        self.root.after(0, self.create_grid)
+
+    def pan(self, dr, dc):
+        r0, c0, h, w = self.view
+        if (h, w) == (self.rows, self.cols):
+            return
+        r0 = min(max(0, r0 + dr * (h // 2)), self.rows - h)
+        c0 = min(max(0, c0 + dc * (w // 2)), self.cols - w)
+        self.view = (r0, c0, h, w)
+        self.create_grid()
+        self.send_viewport()
+
+    def send_viewport(self):
+        self.view_pending = True
+        self.view_sent_at = time.monotonic()
+        self.net.send_viewport(self.view, self.view_sent_at)
+
+    def send_datagram(self, data):
+        try:
+            self.client_socket.sendto(data, (SERVER_NAME, SERVER_PORT))
+        except: pass
+
     def connect_to_server(self):
+        # UDP may drop the Hello or the lobby's answer, keep saying Hello
+        # until the server has given us an id
+        if not self.running or self.my_id is not None:
+            return
         try:
-            self.client_socket.sendto("Hello".encode(), (SERVER_NAME, SERVER_PORT))
+            self.client_socket.sendto(hello_message(), (SERVER_NAME, SERVER_PORT))
         except:
             self.status_label.config(text="Failed to connect")
+        self.root.after(int(HELLO_RETRY * 1000), self.connect_to_server)
+
+    # --- INPUT: moves are coalesced into one EVENT per window ---
+    def on_drag(self, event):
+        r0, c0, h, w = self.view
+        r, c = r0 + event.y // self.cell_px, c0 + event.x // self.cell_px
+        if r0 <= r < r0 + h and c0 <= c < c0 + w:
+            self.send_move(r, c)
 
     def send_move(self, x, y):
-        if self.my_id is not None:
-            msg = f"{x},{y},{self.my_id}"
-            packet = Packet(1, "EVENT", self.snapshotId, self.seq_ID, time.monotonic(), 2048, msg)
-            try:
-                self.client_socket.sendto(json.dumps(packet.__dict__).encode(), (SERVER_NAME, SERVER_PORT))
-                self.seq_ID = 1 - self.seq_ID
-                self.snapshotId += 1
-            except: pass
-
-    # --- NEW: ACK Sender ---
-    def send_ack(self, ack_snapshot_id):
-        packet = Packet(1, "ACK", ack_snapshot_id, self.seq_ID, time.monotonic(), 0, {})
-        try:
-            self.client_socket.sendto(json.dumps(packet.__dict__).encode(), (SERVER_NAME, SERVER_PORT))
-        except: pass
+        if self.my_id is None or [x, y] in self.pending_moves:
+            return
+        self.pending_moves.append([x, y])
+        self.predict(x, y)
+        if self.move_window_ms <= 0 or len(self.pending_moves) >= MAX_EVENT_MOVES:
+            self.flush_moves()
+        elif not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.root.after(self.move_window_ms, self.flush_moves)
+
+    def flush_moves(self):
+        self.flush_scheduled = False
+        if not self.pending_moves:
+            return
+        moves, self.pending_moves = self.pending_moves, []
+        # The ACK is piggybacked, saves a standalone one; a batch too big for
+        # one datagram in the negotiated codec goes out as several EVENTs
+        self.net.send_moves(moves)
+
+    # --- PREDICTION / RECONCILIATION ---
+    def predict(self, r, c):
+        # Paint a free cell in our colour right away, tagged as pending
+        if self.local_grid[r][c] != 0:
+            return
+        with self.prediction_lock:
+            self.predicted.setdefault((r, c), time.monotonic())
+        self.paint(r, c, 0)
+
+    def display_value(self, r, c, val):
+        if val == 0 and (r, c) in self.predicted:
+            return self.my_id + 1
+        return val
+
+    def reconcile(self, owners, results, now):
+        # owners: authoritative {(r, c): value} seen in this packet, results:
+        # (r, c, ok) for our own moves. Returns the rollback latencies.
+        rollbacks = []
+        with self.prediction_lock:
+            if not self.predicted:
+                return rollbacks
+            for cell, val in owners.items():
+                if val != 0 and cell in self.predicted:
+                    clicked = self.predicted.pop(cell)
+                    if val != self.my_id + 1:
+                        rollbacks.append((cell, clicked))
+            for r, c, ok in results:
+                clicked = self.predicted.pop((r, c), None)
+                if clicked is not None and not ok:
+                    rollbacks.append(((r, c), clicked))
+            # The EVENT or its result got lost: give up on the prediction
+            for cell, clicked in list(self.predicted.items()):
+                if now - clicked > PREDICTION_TIMEOUT:
+                    rollbacks.append((cell, self.predicted.pop(cell)))
+        if rollbacks:
+            with self.dirty_lock:
+                for (r, c), _ in rollbacks:
+                    self.dirty[(r, c)] = self.local_grid[r][c]
+        return [(now - clicked) * 1000 for _, clicked in rollbacks]
+
+    # --- RENDER LOOP (Tk thread, at most RENDER_FPS frames per second) ---
+    def set_status(self, text):
+        with self.dirty_lock:
+            self.pending_status = text
+
+    def request_render(self):
+        # Called by the network thread; at most one frame is ever queued
+        with self.dirty_lock:
+            self.packets_since_render += 1
+            if self.render_scheduled:
+                return
+            self.render_scheduled = True
+            delay = max(0.0, self.last_render + 1.0 / RENDER_FPS - time.monotonic())
+        self.root.after(int(delay * 1000), self.render)
+
+    def render(self):
+        started = time.monotonic()
+        with self.dirty_lock:
+            dirty, self.dirty = self.dirty, {}
+            status, self.pending_status = self.pending_status, None
+            packets, self.packets_since_render = self.packets_since_render, 0
+            self.render_scheduled = False
+            self.last_render = started
+        for (r, c), val in dirty.items():
+            self.paint(r, c, val)
+        if status is not None:
+            self.status_label.config(text=status)
+        if started - self.last_stats >= STATS_INTERVAL:
+            self.last_stats = started
+            self.show_stats(started)
+        render_ms = (time.monotonic() - started) * 1000
+        since = started - self.start_time if self.start_time is not None else 0
+        self.render_metrics.write({"time_since_start_s": round(since, 3), "render_ms": round(render_ms, 3),
+                                   "cells_painted": len(dirty), "packets_merged": packets})
+
+    def show_stats(self, now):
+        (p50, p99), (j99,) = self.latency_hist.percentiles((0.5, 0.99), now), self.jitter_hist.percentiles((0.99,), now)
+        if p50 is None:
+            return
+        rtt = self.net.clock.srtt
+        self.lbl_ping.config(text=f"One-way: {self.previous_latency:.0f}ms" +
+                                  (f"  RTT: {rtt * 1000:.0f}ms" if rtt is not None else ""))
+        self.lbl_stats.config(text=f"p50 {p50:.1f}ms  p99 {p99:.1f}ms  jitter p99 {j99:.1f}ms  "
+                                   f"{self.bandwidth.rate(now) * 8 / 1000:.1f} kbps")
+
+    def paint(self, r, c, val):
+        rect = self.grid_rects.get((r, c))
+        if rect is not None:
+            self.canvas.itemconfig(rect, fill=PLAYER_COLORS.get(self.display_value(r, c, val), "white"))
 
     def listen_to_server(self):
         while self.running:
             try:
-                data, _ = self.client_socket.recvfrom(4096)
+                data, _ = self.client_socket.recvfrom(RECV_BUFFER)
                 recv_time_obj = time.monotonic()
                 self.total_bytes_received += len(data)
+                self.bandwidth.add(len(data), recv_time_obj)
 
                 if self.start_time is None: self.start_time = recv_time_obj
                 if self.bandwidth_start_time is None: self.bandwidth_start_time = time.time()
 
-                msg = json.loads(data.decode())
+                # Decodes and applies the update to the board, ACK bookkeeping included
+                update = self.net.receive(data, recv_time_obj)
+                self.net.maybe_ping(recv_time_obj)
+                if update.pong:
+                    continue
+                msg, payload = update.msg, update.payload
                 relative_time_ms = (recv_time_obj - self.start_time) * 1000
                 
-                # Metric Calculation
+                # Metric Calculation; latency is one-way on the clock-synced timeline
                 latency_ms = 0
                 jitter_ms = 0
-                server_ts_str = msg.get("server_timestamp")
-                if server_ts_str:
-                    try:
-                        server_ts = float(server_ts_str)
-                        latency_ms = (recv_time_obj - server_ts) * 1000
-                        jitter_ms = abs(latency_ms - self.previous_latency)
-                        self.previous_latency = latency_ms
-                    except: pass
-
-                payload = msg.get("payload", {})
-                
+                if update.latency_ms is not None:
+                    latency_ms = update.latency_ms
+                    jitter_ms = abs(latency_ms - self.previous_latency)
+                    self.previous_latency = latency_ms
+                    self.latency_hist.record(latency_ms, recv_time_obj)
+                    self.jitter_hist.record(jitter_ms, recv_time_obj)
+
                 # --- HANDLING UPDATES ---
-                perceivedError = 0
-                
-                # 1. DELTA UPDATE ("Changes")
-                if "Changes" in payload:
-                    changes = payload["Changes"]
-                    for r, c, val in changes:
-                        if self.local_grid[r][c] != val:
-                            perceivedError += 1
-                    self.root.after(0, lambda c=changes: self.apply_changes(c))
-
-                # 2. FULL SNAPSHOT ("Grid")
-                elif "Grid" in payload:
-                    server_grid = payload["Grid"]
-                    for r in range(GRID_SIZE):
-                        for c in range(GRID_SIZE):
-                            if self.local_grid[r][c] != server_grid[r][c]:
-                                perceivedError += 1
-                    self.root.after(0, lambda g=server_grid: self.update_grid(g))
-
-                # 3. IDENTITY
-                if "id" in payload and self.my_id is None:
-                    self.my_id = payload["id"]
+                perceivedError = len(update.changed)
+                with self.dirty_lock:
+                    self.dirty.update(update.changed)
+
+                # Viewport confirmed once a region snapshot inside it arrives
+                if "Origin" in payload and self.view_pending:
+                    r0, c0 = payload["Origin"]
+                    vr, vc, vh, vw = self.view
+                    if vr <= r0 < vr + vh and vc <= c0 < vc + vw:
+                        self.view_pending = False
+
+                if update.resized:
+                    self.on_board_size(self.rows, self.cols)
+                if "id" in payload and self.my_id is not None:
                     self.root.title(f"Player {self.my_id + 1}")
+                    self.open_metrics()
 
                 if "Message" in payload:
                     text = payload["Message"]
-                    self.root.after(0, lambda m=text: self.status_label.config(text=m))
-                    if "WON" in text: self.save_csv()
+                    self.set_status(text)
+                    if "WON" in text or self.net.game_over: self.save_csv()
+
+                # MOVE RESULTS of the tick (replace the old per-move INFO reply),
+                # the final "WON" message keeps the label
+                if update.results:
+                    self.set_status("Nice move!" if update.results[-1][2] else "Cell already taken!")
+
+                # CONFIRM OR ROLL BACK predicted cells
+                rollback_ms = self.reconcile(update.owners, update.results, recv_time_obj) if self.my_id is not None else []
+                self.mispredictions += len(rollback_ms)
+                self.rollback_ms_total += sum(rollback_ms)
+                self.request_render()
+
+                # UDP may drop the VIEWPORT request, keep asking until the region arrives
+                if self.view_pending and recv_time_obj - self.view_sent_at > VIEWPORT_RESEND:
+                    self.send_viewport()
 
                 # --- CRITICAL: SEND ACK ---
-                recvd_snap = msg.get("snapshot_id")
-                # Do NOT Ack -1 (Info) or 0 (Handshake) to avoid confusing logic
-                if recvd_snap is not None and recvd_snap > 0:
-                    self.send_ack(recvd_snap)
+                self.net.maybe_ack(recv_time_obj)
 
                 # Store Metrics
-                self.metrics_log.append({
+                self.metrics.write({
                     "snapshot_id": msg.get("snapshot_id"),
                     "seq_num": msg.get("seq_num"),
                     "time_since_start_ms": round(relative_time_ms, 3), 
@@ -164,47 +366,49 @@ class GridClashGUI:
                     "latency_ms": round(latency_ms, 3),
                     "jitter_ms": round(jitter_ms, 3),
                     "perceived_position_error" : perceivedError,
-                    "bandwidth_per_client_kbps" : ""
+                    "mispredictions": len(rollback_ms),
+                    "rollback_latency_ms": round(sum(rollback_ms) / len(rollback_ms), 3) if rollback_ms else "",
+                    "bandwidth_per_client_kbps" : round(self.bandwidth.rate(recv_time_obj) * 8 / 1000, 3),
+                    **self.clock_columns()
                 })
 
             except Exception as e:
                 continue
 
-    def apply_changes(self, changes):
-        for r, c, val in changes:
-            self.local_grid[r][c] = val
-            self.canvas.itemconfig(self.grid_rects[r][c], fill=PLAYER_COLORS.get(val, "white"))
+    def clock_columns(self):
+        clock = self.net.clock.summary()
+        return {"rtt_ms": clock["rtt_ms"] if clock["rtt_ms"] is not None else "",
+                "clock_offset_ms": clock["clock_offset_ms"] if clock["clock_offset_ms"] is not None else ""}
 
-    def update_grid(self, grid):
-        for r in range(GRID_SIZE):
-            for c in range(GRID_SIZE):
-                val = grid[r][c]
-                if self.local_grid[r][c] != val:
-                    self.local_grid[r][c] = val 
-                    self.canvas.itemconfig(self.grid_rects[r][c], fill=PLAYER_COLORS.get(val, "white"))
+    def open_metrics(self):
+        try:
+            self.metrics.open(f"client_metrics_{self.my_id}.csv")
+            self.render_metrics.open(f"client_render_metrics_{self.my_id}.csv")
+        except Exception as e:
+            print(f"Error opening metrics files: {e}")
 
     def save_csv(self):
-        if not self.metrics_log: return
+        # Flushes what is left and appends the session summary row; the
+        # streamed rows are already on disk
         try:
-            pid = self.my_id if self.my_id is not None else "unknown"
-            filename = f"client_metrics_{self.my_id}.csv"
-            with open(filename, "w", newline="") as f:
-                headers = ["snapshot_id", "seq_num", "time_since_start_ms", "timestamp_epoch_ms", "latency_ms", "jitter_ms" , "perceived_position_error" , "bandwidth_per_client_kbps"]
-                writer = csv.DictWriter(f, fieldnames=headers)
-                writer.writeheader()
-                writer.writerows(self.metrics_log)
-                
-                duration = time.time() - self.bandwidth_start_time
-                bandwidth_kbps = (self.total_bytes_received * 8) / 1000 / duration if duration > 0 else 0
-                
-                last_metric = {
-                    "snapshot_id": "", "seq_num": "", "time_since_start_ms": "",
-                    "timestamp_epoch_ms":"", "latency_ms": "", "jitter_ms": "",
-                    "perceived_position_error" : "",
-                    "bandwidth_per_client_kbps" : bandwidth_kbps
-                }
-                writer.writerow(last_metric)
-            print(f"Metrics saved to {filename}")
+            duration = time.time() - self.bandwidth_start_time if self.bandwidth_start_time else 0
+            bandwidth_kbps = (self.total_bytes_received * 8) / 1000 / duration if duration > 0 else 0
+            last_metric = {
+                "snapshot_id": "", "seq_num": "", "time_since_start_ms": "",
+                "timestamp_epoch_ms":"", "latency_ms": "", "jitter_ms": "",
+                "perceived_position_error" : "",
+                # Totals for the whole session in the summary row
+                "mispredictions": self.mispredictions,
+                "rollback_latency_ms": self.rollback_ms_total / self.mispredictions if self.mispredictions else 0,
+                "bandwidth_per_client_kbps" : bandwidth_kbps,
+                # Best path seen and the clock model the latencies were corrected with
+                "rtt_ms": self.net.clock.summary()["min_rtt_ms"] or "",
+                "clock_offset_ms": self.clock_columns()["clock_offset_ms"]
+            }
+            if self.metrics.close(last_metric):
+                print(f"Metrics saved to {self.metrics.path}")
+            if self.render_metrics.close():
+                print(f"Render metrics saved to {self.render_metrics.path}")
         except Exception as e:
             print(f"Error saving CSV: {e}")
 
@@ -214,6 +418,11 @@ class GridClashGUI:
         self.root.destroy()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grid Clash client")
+    parser.add_argument("--move-window", type=int, default=MOVE_WINDOW_MS,
+                        help="ms to collect clicks into one EVENT packet (0 = one packet per click)")
+    args = parser.parse_args()
+
     root = tk.Tk()
-    app = GridClashGUI(root)
+    app = GridClashGUI(root, args.move_window)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,154 @@
+import csv
+import math
+import threading
+import time
+
+# ---------------- CLIENT METRICS SINK ----------------
+# Client telemetry that costs the same after an hour as after a minute:
+#   MetricsWriter     - appends CSV rows in batches and flushes them to disk at
+#                       least every FLUSH_SECONDS, so a crash loses one batch
+#                       at most instead of the whole session
+#   RollingHistogram  - HDR-style log-linear buckets (about 3 % resolution)
+#                       over the last `window` seconds, for live percentiles
+#   WindowedRate      - bytes per second over the last `window` seconds
+
+FLUSH_ROWS = 256
+FLUSH_SECONDS = 1.0
+SUB_BUCKETS = 32  # buckets per power of two; relative error <= 1 / SUB_BUCKETS
+
+
+class MetricsWriter:
+    def __init__(self, fieldnames, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS):
+        self.fieldnames = fieldnames
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.path = None
+        self.file = None
+        self.writer = None
+        self.batch = []
+        self.last_flush = time.monotonic()
+        self.rows_written = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def open(self, path):
+        # Rows written before the file name is known wait in the batch
+        with self.lock:
+            if self.file is not None or self.closed:
+                return
+            self.path = path
+            self.file = open(path, "w", newline="")
+            self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames)
+            self.writer.writeheader()
+            self._flush()
+
+    def write(self, row):
+        with self.lock:
+            if self.closed:
+                return
+            self.batch.append(row)
+            if self.file is not None and (len(self.batch) >= self.flush_rows
+                                          or time.monotonic() - self.last_flush >= self.flush_seconds):
+                self._flush()
+
+    def _flush(self):
+        if self.batch and self.file is not None:
+            self.writer.writerows(self.batch)
+            self.rows_written += len(self.batch)
+            self.batch = []
+            self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self, summary=None):
+        with self.lock:
+            if self.closed or self.file is None:
+                return False
+            if summary is not None:
+                self.batch.append(summary)
+            self._flush()
+            self.file.close()
+            self.closed = True
+            return True
+
+
+class RollingHistogram:
+    def __init__(self, window=10.0, slices=5):
+        self.slice_len = window / slices
+        self.slices = [(None, {}) for _ in range(slices)]  # (slice number, {bucket: count})
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _bucket(value):
+        if value <= 0:
+            return -1 << 20  # zero and below share one bucket
+        mantissa, exponent = math.frexp(value)  # value = mantissa * 2**exponent, 0.5 <= mantissa < 1
+        return exponent * SUB_BUCKETS + int((mantissa - 0.5) * 2 * SUB_BUCKETS)
+
+    @staticmethod
+    def _upper(bucket):
+        if bucket == -1 << 20:
+            return 0.0
+        exponent, sub = divmod(bucket, SUB_BUCKETS)
+        return math.ldexp(0.5 + (sub + 1) / (2 * SUB_BUCKETS), exponent)
+
+    def _current(self, now):
+        number = int(now / self.slice_len)
+        idx = number % len(self.slices)
+        if self.slices[idx][0] != number:
+            self.slices[idx] = (number, {})
+        return self.slices[idx][1]
+
+    def record(self, value, now=None):
+        now = time.monotonic() if now is None else now
+        bucket = self._bucket(value)
+        with self.lock:
+            counts = self._current(now)
+            counts[bucket] = counts.get(bucket, 0) + 1
+
+    def percentiles(self, qs, now=None):
+        # Values at the given quantiles (0..1) over the window; None when empty
+        now = time.monotonic() if now is None else now
+        oldest = int(now / self.slice_len) - len(self.slices) + 1
+        merged = {}
+        with self.lock:
+            for number, counts in self.slices:
+                if number is not None and number >= oldest:
+                    for bucket, n in counts.items():
+                        merged[bucket] = merged.get(bucket, 0) + n
+        total = sum(merged.values())
+        if not total:
+            return [None for _ in qs]
+        ordered = sorted(merged.items())
+        out = []
+        for q in qs:
+            rank, seen = max(1, math.ceil(q * total)), 0
+            for bucket, n in ordered:
+                seen += n
+                if seen >= rank:
+                    out.append(self._upper(bucket))
+                    break
+        return out
+
+
+class WindowedRate:
+    def __init__(self, window=1.0, slices=10):
+        self.slice_len = window / slices
+        self.window = window
+        self.slices = [(None, 0) for _ in range(slices)]  # (slice number, amount)
+
+    def add(self, amount, now=None):
+        now = time.monotonic() if now is None else now
+        number = int(now / self.slice_len)
+        idx = number % len(self.slices)
+        start, total = self.slices[idx]
+        self.slices[idx] = (number, (total if start == number else 0) + amount)
+
+    def rate(self, now=None):
+        # Amount per second over the window ending now
+        now = time.monotonic() if now is None else now
+        oldest = int(now / self.slice_len) - len(self.slices) + 1
+        return sum(total for number, total in list(self.slices) if number is not None and number >= oldest) / self.window
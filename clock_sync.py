@@ -0,0 +1,93 @@
+from collections import deque
+
+# ---------------- CLOCK SYNC ----------------
+# Server timestamps are the server's monotonic clock, which only means
+# something on the client when both run on the same host. The client pings
+# the server NTP-style and maps server times onto its own clock:
+#
+#   T1 client sends PING   T2 server receives   T3 server sends PONG   T4 client receives
+#   offset = ((T2 - T1) + (T3 - T4)) / 2    server clock - client clock
+#   rtt    = (T4 - T1) - (T3 - T2)          network round trip, server time excluded
+#
+# A sample is only as good as its path was symmetric, and queueing makes it
+# asymmetric, so only the lowest-RTT sample of every FILTER_GROUP consecutive
+# pings is used. A least-squares line through those minima over the last
+# SYNC_WINDOW pings gives the offset, and its slope the drift between the
+# two clocks. With one direction slower than the other the offset is off by
+# half the difference; that is the part of one-way latency no two-clock
+# measurement can recover.
+
+PING_INTERVAL = 1.0  # seconds between PINGs once synced
+PING_INTERVAL_FAST = 0.2  # until MIN_SAMPLES PONGs are in
+MIN_SAMPLES = 4
+SYNC_WINDOW = 128  # samples kept; at PING_INTERVAL about two minutes
+FILTER_GROUP = 8  # consecutive samples each minimum is picked from
+MAX_DRIFT = 500e-6  # clamp for the fitted drift; quartz is within ~100 ppm
+
+
+class ClockSync:
+    def __init__(self):
+        self.samples = deque(maxlen=SYNC_WINDOW)  # (client time, offset, rtt)
+        self.last_ping = None
+        self.ping_seq = 0
+        self.rtt = None  # newest sample
+        self.srtt = None  # smoothed like TCP, alpha 1/8
+        self.min_rtt = None
+        # offset(t) = offset + drift * (t - ref), t on the client clock
+        self.offset = None
+        self.drift = 0.0
+        self.ref = 0.0
+
+    @property
+    def synced(self):
+        return self.offset is not None
+
+    def ping_due(self, now):
+        interval = PING_INTERVAL if len(self.samples) >= MIN_SAMPLES else PING_INTERVAL_FAST
+        return self.last_ping is None or now - self.last_ping >= interval
+
+    def on_pong(self, t1, t2, t3, t4):
+        rtt = (t4 - t1) - (t3 - t2)
+        if rtt < 0:
+            return  # a clock step in between, the sample means nothing
+        self.samples.append(((t1 + t4) / 2, ((t2 - t1) + (t3 - t4)) / 2, rtt))
+        self.rtt = rtt
+        self.srtt = rtt if self.srtt is None else self.srtt + (rtt - self.srtt) / 8
+        self.min_rtt = min(s[2] for s in self.samples)
+        self._fit()
+
+    def _fit(self):
+        samples = list(self.samples)
+        # Groups counted back from the newest sample, so the newest group is full
+        best = [min(samples[max(0, end - FILTER_GROUP):end], key=lambda s: s[2])
+                for end in range(len(samples), 0, -FILTER_GROUP)]
+        ref = sum(s[0] for s in best) / len(best)
+        mean = sum(s[1] for s in best) / len(best)
+        spread = sum((s[0] - ref) ** 2 for s in best)
+        drift = 0.0
+        # A slope over a few seconds is mostly noise; wait for a real baseline
+        if len(best) >= 2 and max(s[0] for s in best) - min(s[0] for s in best) >= SYNC_WINDOW * PING_INTERVAL / 4:
+            drift = sum((s[0] - ref) * (s[1] - mean) for s in best) / spread
+            drift = max(-MAX_DRIFT, min(MAX_DRIFT, drift))
+        self.offset, self.drift, self.ref = mean, drift, ref
+
+    # --- MAPPING ---
+    def offset_at(self, t):
+        return self.offset + self.drift * (t - self.ref)
+
+    def to_client(self, server_time):
+        # A server timestamp on the client clock (raw when not synced yet)
+        if self.offset is None:
+            return server_time
+        # The drift term wants client time; one step from the plain offset is exact to ppm^2
+        return server_time - self.offset_at(server_time - self.offset)
+
+    def one_way_ms(self, server_time, received_at):
+        # Server send -> client receive on the corrected timeline
+        return (received_at - self.to_client(server_time)) * 1000
+
+    def summary(self):
+        # Milliseconds / ppm for CSVs and the stats line; None before the first PONG
+        ms = lambda v: None if v is None else round(v * 1000, 3)
+        return {"rtt_ms": ms(self.srtt), "min_rtt_ms": ms(self.min_rtt),
+                "clock_offset_ms": ms(self.offset), "clock_drift_ppm": round(self.drift * 1e6, 2)}
@@ -0,0 +1,184 @@
+import time
+from acks import AckWindow, hold_ms
+from clock_sync import ClockSync
+from protocol import (Packet, CODEC_JSON, MAX_DATAGRAM, MAX_EVENT_MOVES, Reassembler, encode_packet, decode_packet,
+                      hello_message)
+
+# ---------------- HEADLESS CLIENT ----------------
+# The network side of a player, without any UI: the "Hello" handshake and
+# codec negotiation, applying snapshots and deltas to a local board,
+# reassembling fragmented updates, cumulative ACKs and clock sync PINGs
+# (clock_sync.ClockSync) so latencies hold across hosts. It never owns a
+# socket; `send` is any callable taking the datagram bytes, so the same class
+# drives the tkinter client's network thread and the asyncio bots of
+# load_test.py.
+
+GRID_SIZE = 20  # until the server announces the real board size
+ACK_INTERVAL = 0.1  # seconds between standalone ACKs; EVENTs carry one as well
+
+
+class Update:
+    # What one received datagram did to the client state
+    def __init__(self, msg, payload, received_at):
+        self.msg = msg
+        self.payload = payload
+        self.received_at = received_at
+        self.latency_ms = None  # server send -> receive, server time mapped onto the client clock
+        self.pong = False  # a clock sync reply, nothing else in it
+        self.changed = {}  # (r, c) -> value for cells whose local value changed
+        self.owners = {}  # authoritative (r, c) -> value for every cell the packet covered
+        self.results = []  # (r, c, ok) of our own moves, while the game is running
+        self.resized = False  # the handshake announced a new board size
+        self.complete = False  # a whole update (every part) has now been received
+
+
+class GameClient:
+    def __init__(self, send, rows=GRID_SIZE, cols=GRID_SIZE):
+        self.send = send
+        self.clock = ClockSync()  # the server's clock stays the same across matches
+        self.reset(rows, cols)
+
+    def reset(self, rows=GRID_SIZE, cols=GRID_SIZE):
+        # Fresh state for a new match
+        self.my_id = None
+        self.codec = CODEC_JSON  # upgraded once the server answers the Hello
+        self.set_board_size(rows, cols)
+        self.reassembler = Reassembler()
+        self.acks = AckWindow()
+        self.last_ack_sent = 0
+        # Newest snapshot id the board is complete up to. A delta only moves it
+        # when its base is at or before it; any delta is applied regardless,
+        # which fills in every missed tick it carries.
+        self.synced_id = -1
+        self.seq_ID = 0
+        self.snapshotId = 0
+        self.game_over = False
+
+    def set_board_size(self, rows, cols):
+        self.rows, self.cols = rows, cols
+        self.grid = [[0]*cols for _ in range(rows)]
+
+    def connect(self):
+        self.send(hello_message())
+
+    # --- RECEIVE ---
+    def receive(self, data, now=None):
+        now = time.monotonic() if now is None else now
+        msg = decode_packet(data)
+        payload = msg.get("payload", {})
+        update = Update(msg, payload, now)
+        grid = self.grid
+
+        if msg.get("msg_type") == "PONG":
+            update.pong = True
+            self.clock.on_pong(payload["T1"], payload["T2"], payload["T3"], now)
+            return update
+
+        server_ts = msg.get("server_timestamp")
+        if server_ts:
+            try:
+                update.latency_ms = self.clock.one_way_ms(float(server_ts), now)
+            except (TypeError, ValueError):
+                pass
+
+        # 1. DELTA UPDATE ("Changes")
+        if "Changes" in payload:
+            for r, c, val in payload["Changes"]:
+                if grid[r][c] != val:
+                    grid[r][c] = val
+                    update.changed[(r, c)] = val
+                update.owners[(r, c)] = val
+
+        # 2. FULL SNAPSHOT ("Grid"), or one rectangular part of it ("Origin")
+        elif "Grid" in payload:
+            r0, c0 = payload.get("Origin", (0, 0))
+            for r, row in enumerate(payload["Grid"], r0):
+                for c, val in enumerate(row, c0):
+                    if grid[r][c] != val:
+                        grid[r][c] = val
+                        update.changed[(r, c)] = val
+                    if val:
+                        update.owners[(r, c)] = val
+
+        # 3. IDENTITY + CODEC NEGOTIATION
+        if "codec" in payload:
+            self.codec = payload["codec"]
+        if "rows" in payload and (payload["rows"], payload["cols"]) != (self.rows, self.cols):
+            self.set_board_size(payload["rows"], payload["cols"])
+            update.resized = True
+        if "id" in payload and self.my_id is None:
+            self.my_id = payload["id"]
+
+        # 4. MOVE RESULTS of the tick; the final board carries them too but
+        # then the game is already decided
+        if "Results" in payload and payload.get("gameOngoing") and self.my_id is not None:
+            update.results = [(r, c, ok) for pid, r, c, ok in payload["Results"] if pid == self.my_id + 1]
+        if "Grid" in payload and payload.get("gameOngoing") is False:
+            self.game_over = True
+        if msg.get("msg_type") == "INFO" and payload.get("gameOngoing") is False:
+            self.game_over = True  # the server closed the match without a winner
+
+        # 5. ACK BOOKKEEPING. Do NOT Ack -1 (Info) or 0 (Handshake)
+        recvd_snap = msg.get("snapshot_id")
+        if isinstance(recvd_snap, int) and recvd_snap > 0:
+            # A fragmented update only counts as received once all its parts are in
+            if "Parts" not in payload or self.reassembler.add(recvd_snap, payload["Part"], payload["Parts"], now):
+                update.complete = True
+                self.acks.record(recvd_snap, now)
+                if "Grid" in payload or payload.get("Base", self.synced_id) <= self.synced_id:
+                    self.synced_id = max(self.synced_id, recvd_snap)
+        return update
+
+    # --- SEND ---
+    def maybe_ack(self, now=None):
+        # Standalone ACKs at a reduced rate, the mask covers the ids in between
+        now = time.monotonic() if now is None else now
+        if self.acks.state is not None and now - self.last_ack_sent >= ACK_INTERVAL:
+            self.send_ack(now)
+
+    def maybe_ping(self, now=None):
+        now = time.monotonic() if now is None else now
+        if self.clock.ping_due(now):
+            self.send_ping(now)
+
+    def send_ping(self, now=None):
+        # T1 rides in the body; the PONG echoes it with the server's T2 and T3
+        clock = self.clock
+        clock.last_ping = time.monotonic() if now is None else now
+        clock.ping_seq += 1
+        packet = Packet(1, "PING", -1, clock.ping_seq, clock.last_ping, 0, {"T1": clock.last_ping})
+        self.send(encode_packet(packet, self.codec))
+
+    def send_ack(self, now=None):
+        # Cumulative: latest id + bitmask of the 32 before it
+        ack = self.acks.state
+        self.last_ack_sent = time.monotonic() if now is None else now
+        payload = {"Bits": ack[1], "Synced": self.synced_id, "Hold": hold_ms(ack, self.last_ack_sent)}
+        packet = Packet(1, "ACK", ack[0], self.seq_ID, self.last_ack_sent, 0, payload)
+        self.send(encode_packet(packet, self.codec))
+
+    def send_moves(self, moves, now=None):
+        # One EVENT for a list of [r, c] cells, with the current ACK piggybacked.
+        # A list over MAX_EVENT_MOVES, or one whose encoding would not fit
+        # MAX_DATAGRAM (JSON on a large board), is halved into several EVENTs
+        now = time.monotonic() if now is None else now
+        payload = {"Moves": moves, "id": self.my_id}
+        ack = self.acks.state
+        if ack is not None:
+            self.last_ack_sent = now
+            payload["Ack"] = [ack[0], ack[1], self.synced_id, hold_ms(ack, now)]
+        packet = Packet(1, "EVENT", self.snapshotId, self.seq_ID, now, 0, payload)
+        data = encode_packet(packet, self.codec)
+        if len(moves) > 1 and (len(moves) > MAX_EVENT_MOVES or len(data) > MAX_DATAGRAM):
+            half = len(moves) // 2
+            self.send_moves(moves[:half], now)
+            self.send_moves(moves[half:], now)
+            return
+        self.send(data)
+        self.seq_ID = 1 - self.seq_ID
+        self.snapshotId += 1
+
+    def send_viewport(self, rect, now=None):
+        now = time.monotonic() if now is None else now
+        packet = Packet(1, "VIEWPORT", self.snapshotId, self.seq_ID, now, 0, {"Rect": list(rect)})
+        self.send(encode_packet(packet, self.codec))
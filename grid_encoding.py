@@ -0,0 +1,162 @@
+import zlib
+from itertools import groupby
+
+# ---------------- CELL ENCODINGS ----------------
+# Compact forms for the cell bytes of the binary SNAPSHOT and DELTA bodies.
+# Every candidate is built and the smallest one wins, per packet:
+#   raw    - one byte per cell (the plain layout)
+#   packed - 1, 2 or 4 bits per cell, as few as the largest value needs
+#   rle    - (run length varint, value) pairs; boards are mostly long runs
+#   zlib   - raw deflate primed with ZDICT, so even small parts compress
+# A packed block is: encoding byte, varint byte length, data.
+#
+# Deltas send their cells as sorted index gaps (varints, usually one byte
+# each) instead of (row, col) pairs, followed by the values as a cell block.
+
+ENC_RAW = 0
+ENC_PACKED = 1
+ENC_RLE = 2
+ENC_ZLIB = 3
+ENCODING_NAMES = {ENC_RAW: "raw", ENC_PACKED: "packed", ENC_RLE: "rle", ENC_ZLIB: "zlib"}
+
+# Typical content: long empty runs, runs of each player, and mixed stretches
+ZDICT = (bytes(64) + b"".join(bytes([v]) * 32 for v in (1, 2, 3, 4)) +
+         bytes([1, 2, 3, 4, 0]) * 8 + bytes([0, 1, 0, 2, 0, 3, 0, 4]) * 4)
+
+
+def put_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def get_varint(buf, offset):
+    n = shift = 0
+    while True:
+        byte = buf[offset]
+        offset += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, offset
+        shift += 7
+
+
+# ---------------- CELL BLOCKS ----------------
+def _pack_bits(cells):
+    top = max(cells, default=0)
+    width = 1 if top < 2 else 2 if top < 4 else 4 if top < 16 else 8
+    if width == 8:
+        return None
+    per = 8 // width
+    out = bytearray([width])
+    for start in range(0, len(cells), per):
+        byte = 0
+        for v in cells[start:start + per]:
+            byte = (byte << width) | v
+        out.append(byte << width * (per - len(cells[start:start + per])))
+    return bytes(out)
+
+def _unpack_table(width):
+    # The cells held by each byte value, so decoding is one lookup per byte
+    per = 8 // width
+    mask = (1 << width) - 1
+    shifts = [width * (per - 1 - i) for i in range(per)]
+    return [bytes((b >> s) & mask for s in shifts) for b in range(256)]
+
+_UNPACK_TABLES = {width: _unpack_table(width) for width in (1, 2, 4)}
+
+def _unpack_bits(data, count):
+    table = _UNPACK_TABLES[data[0]]
+    return b"".join([table[b] for b in data[1:]])[:count]
+
+def _rle(cells):
+    out = bytearray()
+    for value, run in groupby(cells):
+        put_varint(out, sum(1 for _ in run))
+        out.append(value)
+    return bytes(out)
+
+def _unrle(data):
+    parts, offset = [], 0
+    while offset < len(data):
+        run, offset = get_varint(data, offset)
+        parts.append(bytes([data[offset]]) * run)
+        offset += 1
+    return b"".join(parts)
+
+def _deflate(cells):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, ZDICT)
+    return compressor.compress(cells) + compressor.flush()
+
+def _inflate(data):
+    return zlib.decompressobj(-15, zdict=ZDICT).decompress(data)
+
+_ENCODERS = {ENC_RAW: bytes, ENC_PACKED: _pack_bits, ENC_RLE: _rle, ENC_ZLIB: _deflate}
+
+def encode_with(encoding, cells):
+    # The cell bytes in one given encoding, None when it cannot hold them
+    if encoding not in _ENCODERS:
+        raise ValueError(f"Unknown cell encoding {encoding}")
+    return _ENCODERS[encoding](bytes(cells))
+
+def encode_cells(cells):
+    # (encoding, data) of the smallest representation of the cell bytes
+    cells = bytes(cells)
+    best = (ENC_RAW, cells)
+    for encoding in (ENC_PACKED, ENC_RLE, ENC_ZLIB):
+        data = _ENCODERS[encoding](cells)
+        if data is not None and len(data) < len(best[1]):
+            best = (encoding, data)
+    return best
+
+def decode_cells(encoding, data, count):
+    if encoding == ENC_RAW:
+        return bytes(data)
+    if encoding == ENC_PACKED:
+        return _unpack_bits(data, count)
+    if encoding == ENC_RLE:
+        return _unrle(data)
+    if encoding == ENC_ZLIB:
+        return _inflate(data)
+    raise ValueError(f"Unknown cell encoding {encoding}")
+
+def pack_cells(cells):
+    encoding, data = encode_cells(cells)
+    out = bytearray([encoding])
+    put_varint(out, len(data))
+    return bytes(out + data)
+
+def unpack_cells(buf, offset, count):
+    # (cell bytes, offset after the block)
+    encoding = buf[offset]
+    size, offset = get_varint(buf, offset + 1)
+    return decode_cells(encoding, buf[offset:offset + size], count), offset + size
+
+
+# ---------------- DELTA CHANGES ----------------
+def pack_changes(changes):
+    # [[r, c, v], ...] as: stride, count, index gaps, value block. The stride
+    # is only the widest column seen, so the body needs no board geometry.
+    # A cell listed twice keeps its last value; gaps must never go negative.
+    stride = max((c for _, c, _ in changes), default=0) + 1
+    cells = sorted({r * stride + c: v for r, c, v in changes}.items())
+    out = bytearray()
+    put_varint(out, stride)
+    put_varint(out, len(cells))
+    prev = -1
+    for idx, _ in cells:
+        put_varint(out, idx - prev - 1)
+        prev = idx
+    return bytes(out) + pack_cells(bytes(v for _, v in cells))
+
+def unpack_changes(buf, offset):
+    # ([[r, c, v], ...], offset after the changes)
+    stride, offset = get_varint(buf, offset)
+    n, offset = get_varint(buf, offset)
+    indices, prev = [], -1
+    for _ in range(n):
+        gap, offset = get_varint(buf, offset)
+        prev += gap + 1
+        indices.append(prev)
+    values, offset = unpack_cells(buf, offset, n)
+    return [[idx // stride, idx % stride, v] for idx, v in zip(indices, values)], offset
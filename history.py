@@ -0,0 +1,165 @@
+import math
+from array import array
+
+# ---------------- SNAPSHOT HISTORY ----------------
+# Fixed-size ring of the last `capacity` snapshots. Every slot keeps the compact
+# delta of its tick (cells changed since the previous snapshot id) and every
+# KEYFRAME_INTERVAL-th slot also keeps a full board copy. Any retained snapshot
+# is rebuilt from the nearest keyframe plus at most KEYFRAME_INTERVAL deltas,
+# and the delta from any acked base b is the merge of deltas b+1..latest with
+# last-write-wins per cell, so its cost is O(changes since b) rather than
+# O(board size). Eviction just overwrites the oldest slot.
+#
+# Each tick's delta is also bucketed into BUCKET_SIZE x BUCKET_SIZE tiles of
+# the board, so a delta restricted to a viewport only visits the tiles that
+# intersect it: the cost follows the viewport, not the board.
+
+KEYFRAME_INTERVAL = 10
+BUCKET_SIZE = 16
+
+
+class SnapshotHistory:
+    def __init__(self, capacity, keyframe_interval=KEYFRAME_INTERVAL, cols=None, bucket_size=BUCKET_SIZE):
+        self.capacity = max(1, capacity)
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.cols = cols  # None = board geometry unknown, one bucket for everything
+        self.bucket_size = bucket_size
+        self.bucket_cols = math.ceil(cols / bucket_size) if cols else 1
+        self.slots = [None] * self.capacity  # [snapshot_id, {bucket: (indices, values)}, keyframe]
+        self.oldest_id = None
+        self.latest_id = None
+        self.base_floor = None  # oldest base a delta can be merged from
+
+    @classmethod
+    def for_window(cls, seconds, tick_interval, keyframe_interval=KEYFRAME_INTERVAL, cols=None):
+        # e.g. for_window(2.0, 0.05) keeps 2 seconds of 20 Hz ticks
+        return cls(math.ceil(seconds / tick_interval), keyframe_interval, cols)
+
+    def __len__(self):
+        if self.latest_id is None:
+            return 0
+        return self.latest_id - self.oldest_id + 1
+
+    def __contains__(self, snapshot_id):
+        return self.latest_id is not None and self.oldest_id <= snapshot_id <= self.latest_id
+
+    def _slot(self, snapshot_id):
+        return self.slots[snapshot_id % self.capacity]
+
+    def _bucket(self, idx):
+        if not self.cols:
+            return 0
+        r, c = divmod(idx, self.cols)
+        return (r // self.bucket_size) * self.bucket_cols + c // self.bucket_size
+
+    def _bucketize(self, indices, values):
+        grouped = {}
+        for idx, val in zip(indices, values):
+            idx = int(idx)
+            entry = grouped.get(self._bucket(idx))
+            if entry is None:
+                entry = grouped[self._bucket(idx)] = (array('I'), bytearray())
+            entry[0].append(idx)
+            entry[1].append(int(val))
+        return {b: (idxs, bytes(vals)) for b, (idxs, vals) in grouped.items()}
+
+    def record(self, snapshot_id, snapshot, indices, values):
+        if self.latest_id is not None and snapshot_id != self.latest_id + 1:
+            self.clear()  # ids must stay contiguous for ring lookups
+
+        keyframe = None
+        if self.latest_id is None or self.capacity == 1 or snapshot_id % self.keyframe_interval == 0:
+            keyframe = snapshot
+
+        if len(self) == self.capacity:
+            self.base_floor = self.oldest_id
+            self.oldest_id += 1
+            # The new oldest slot must be rebuildable on its own once its
+            # predecessor is overwritten, so promote it to a keyframe
+            oldest = self._slot(self.oldest_id)
+            if oldest[2] is None and self.oldest_id <= self.latest_id:
+                oldest[2] = self.reconstruct(self.oldest_id)
+        self.slots[snapshot_id % self.capacity] = [snapshot_id, self._bucketize(indices, values), keyframe]
+
+        if self.oldest_id is None:
+            # The first entry has no predecessor, so its delta is not usable
+            self.oldest_id = snapshot_id
+            self.base_floor = snapshot_id
+        self.latest_id = snapshot_id
+
+    def clear(self):
+        self.slots = [None] * self.capacity
+        self.oldest_id = None
+        self.latest_id = None
+        self.base_floor = None
+
+    def covers(self, base_id):
+        # True if a delta from base_id to latest can be built from the ring
+        if self.latest_id is None or base_id is None:
+            return False
+        return self.base_floor <= base_id <= self.latest_id
+
+    def _rect_buckets(self, rect):
+        # {bucket: True if the tile lies entirely inside rect} for tiles touching rect
+        r0, c0, h, w = rect
+        size = self.bucket_size
+        wanted = {}
+        for br in range(r0 // size, (r0 + h - 1) // size + 1):
+            for bc in range(c0 // size, min((c0 + w - 1) // size + 1, self.bucket_cols)):
+                inside = (br * size >= r0 and (br + 1) * size <= r0 + h and
+                          bc * size >= c0 and (bc + 1) * size <= c0 + w)
+                wanted[br * self.bucket_cols + bc] = inside
+        return wanted
+
+    def changes_since(self, base_id, rect=None):
+        # (indices, values) of every cell changed after base_id, optionally
+        # only those inside rect = (r0, c0, h, w), or None if the base has
+        # aged out and a full snapshot is required
+        if not self.covers(base_id):
+            return None
+        wanted = self._rect_buckets(rect) if rect is not None and self.cols else None
+        merged = {}
+        for snapshot_id in range(base_id + 1, self.latest_id + 1):
+            buckets = self._slot(snapshot_id)[1]
+            if wanted is None:
+                for indices, values in buckets.values():
+                    merged.update(zip(indices, values))
+                continue
+            r0, c0, h, w = rect
+            for bucket, inside in wanted.items():
+                entry = buckets.get(bucket)
+                if entry is None:
+                    continue
+                if inside:
+                    merged.update(zip(*entry))
+                    continue
+                for idx, val in zip(*entry):
+                    r, c = divmod(idx, self.cols)
+                    if r0 <= r < r0 + h and c0 <= c < c0 + w:
+                        merged[idx] = val
+        indices = sorted(merged)
+        return indices, [merged[i] for i in indices]
+
+    def reconstruct(self, snapshot_id):
+        # Full board bytes at snapshot_id, or None if it is no longer retained
+        if snapshot_id not in self:
+            return None
+        key_id = snapshot_id
+        while self._slot(key_id)[2] is None:
+            key_id -= 1
+        board = bytearray(self._slot(key_id)[2])
+        for sid in range(key_id + 1, snapshot_id + 1):
+            for indices, values in self._slot(sid)[1].values():
+                for idx, val in zip(indices, values):
+                    board[idx] = val
+        return bytes(board)
+
+    def nbytes(self):
+        total = 0
+        for slot in self.slots:
+            if slot is not None:
+                for indices, values in slot[1].values():
+                    total += indices.itemsize * len(indices) + len(values)
+                if slot[2] is not None:
+                    total += len(slot[2])
+        return total
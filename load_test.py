@@ -0,0 +1,289 @@
+import asyncio
+import argparse
+import random
+import subprocess
+import sys
+import time
+import csv
+from game_client import GameClient
+from match import TICK_RATE
+
+# ---------------- LOAD GENERATOR ----------------
+# Hundreds of headless players (game_client.GameClient) in one asyncio
+# process, each on its own UDP socket. Bots join in steps of --step every
+# --step-secs until --clients are playing; when their match ends they say
+# Hello again and join the next lobby, so the server needs --max-matches 0.
+# After each step it prints what the server sustained at that client count:
+#   moves/s       own move results the bots got back (moves the server applied)
+#   in / out pkt/s datagrams the bots sent / received
+#   update ms     server send -> bot receive (clock-synced, see clock_sync.py)
+#   rtt ms        PING/PONG round trip, server processing excluded
+#   move ms       click -> result of that move
+#   late ms       how much later than scheduled each tick started; the first
+#                 step where its p99 passes half a tick period is where tick
+#                 deadlines start to slip
+#
+#   python load_test.py --spawn-server --clients 400 --step 40 --rate 5
+#   python load_test.py --host 10.0.0.2 --clients 200 --strategy contend
+
+SERVER_SCRIPT = "server+gui+delta.py"
+SERVER_PORT = 12000
+MOVE_WINDOW_MS = 30  # bots coalesce clicks into EVENTs like the GUI client
+REJOIN_DELAY = 0.5  # seconds between a match ending and the next Hello
+HELLO_RETRY = 1.0  # a lost Hello or lobby reply is repeated until the bot has an id
+STRATEGIES = ["random", "sweep", "contend"]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
+
+
+class Stats:
+    # Counters for the current step, swapped out when the step is reported
+    def __init__(self):
+        self.moves = 0
+        self.rejected = 0
+        self.packets_in = 0
+        self.packets_out = 0
+        self.bytes_in = 0
+        self.update_ms = []
+        self.rtt_ms = []
+        self.move_ms = []
+        self.late_ms = []
+
+
+# ---------------- BOT ----------------
+class Bot(asyncio.DatagramProtocol):
+    def __init__(self, harness, index):
+        self.harness = harness
+        self.rng = random.Random(harness.seed * 100003 + index)
+        self.transport = None
+        self.client = GameClient(self.send)
+        self.pending = []  # [r, c] clicked since the last EVENT
+        self.clicked = {}  # (r, c) -> click time, until its result arrives
+        self.sweep = 0
+        self.last_tick = None  # (snapshot_id, server time) of the newest tick seen
+        self.hello_at = 0
+
+    def send(self, data):
+        self.transport.sendto(data)
+        self.harness.stats.packets_out += 1
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.connect()
+
+    def connect(self):
+        self.hello_at = time.monotonic()
+        self.client.connect()
+
+    def datagram_received(self, data, addr):
+        stats = self.harness.stats
+        stats.packets_in += 1
+        stats.bytes_in += len(data)
+        now = time.monotonic()
+        try:
+            update = self.client.receive(data, now)
+        except Exception:
+            return
+        self.client.maybe_ping(now)
+        if update.pong:
+            if self.client.clock.rtt is not None:
+                stats.rtt_ms.append(self.client.clock.rtt * 1000)
+            return
+        if update.latency_ms is not None:
+            stats.update_ms.append(update.latency_ms)
+            self.track_schedule(update.msg, now)
+        for r, c, ok in update.results:
+            clicked = self.clicked.pop((r, c), None)
+            if clicked is not None:
+                stats.move_ms.append((now - clicked) * 1000)
+            if ok:
+                stats.moves += 1
+            else:
+                stats.rejected += 1
+        self.client.maybe_ack(now)
+        if self.client.game_over:
+            self.client.game_over = False
+            asyncio.get_running_loop().call_later(REJOIN_DELAY, self.rejoin)
+
+    def track_schedule(self, msg, now):
+        # Snapshot ids count the match's ticks and carry the tick's start time,
+        # so a tick is late by however much more than (id gap) x period passed
+        # since the previous one. A skipped tick shows as a whole period.
+        sid, sent_at = msg.get("snapshot_id"), float(msg["server_timestamp"])
+        if not isinstance(sid, int) or sid <= 0 or msg.get("payload", {}).get("gameOngoing") is False:
+            return
+        if self.last_tick is not None and sid > self.last_tick[0]:
+            expected = (sid - self.last_tick[0]) / self.harness.tick_rate
+            self.harness.stats.late_ms.append(max(0.0, sent_at - self.last_tick[1] - expected) * 1000)
+        if self.last_tick is None or sid > self.last_tick[0]:
+            self.last_tick = (sid, sent_at)
+
+    def rejoin(self):
+        self.client.reset()
+        self.pending.clear()
+        self.clicked.clear()
+        self.sweep = 0
+        self.last_tick = None
+        self.connect()
+
+    # --- CLICKING ---
+    async def play(self, rate, strategy):
+        while True:
+            await asyncio.sleep(self.rng.expovariate(rate))
+            client = self.client
+            if client.my_id is None and time.monotonic() - self.hello_at > HELLO_RETRY:
+                self.connect()
+            if client.my_id is None or client.synced_id < 0:
+                continue
+            cell = self.pick(strategy)
+            if cell is None or list(cell) in self.pending:
+                continue
+            if not self.pending:
+                asyncio.get_running_loop().call_later(MOVE_WINDOW_MS / 1000, self.flush)
+            self.pending.append(list(cell))
+            self.clicked.setdefault(cell, time.monotonic())
+
+    def pick(self, strategy):
+        client = self.client
+        grid, rows, cols = client.grid, client.rows, client.cols
+        if strategy == "random":
+            for _ in range(8):
+                r, c = self.rng.randrange(rows), self.rng.randrange(cols)
+                if grid[r][c] == 0:
+                    return (r, c)
+            return None
+        # sweep: every player walks its own stripe; contend: everyone walks
+        # the same order, so most clicks race for the same cells
+        players = 1 if strategy == "contend" else 4
+        offset = 0 if strategy == "contend" else client.my_id
+        while True:
+            idx = self.sweep * players + offset
+            if idx >= rows * cols:
+                return None
+            self.sweep += 1
+            r, c = divmod(idx, cols)
+            if grid[r][c] == 0:
+                return (r, c)
+
+    def flush(self):
+        if self.pending and self.client.my_id is not None:
+            moves, self.pending = self.pending, []
+            self.client.send_moves(moves)
+
+
+# ---------------- HARNESS ----------------
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.seed = args.seed
+        self.tick_rate = args.tick_rate
+        self.stats = Stats()
+        self.bots = []
+        self.tasks = []
+        self.rows = []  # one report row per step
+
+    async def add_bots(self, count):
+        loop = asyncio.get_running_loop()
+        for _ in range(count):
+            index = len(self.bots)
+            _, bot = await loop.create_datagram_endpoint(
+                lambda: Bot(self, index), remote_addr=(self.args.host, self.args.port))
+            self.bots.append(bot)
+            self.tasks.append(asyncio.create_task(bot.play(self.args.rate, self.args.strategy)))
+
+    def report(self, clients, seconds):
+        stats, self.stats = self.stats, Stats()
+        update_ms, move_ms, late_ms = sorted(stats.update_ms), sorted(stats.move_ms), sorted(stats.late_ms)
+        rtt_ms = sorted(stats.rtt_ms)
+        row = {
+            "clients": clients,
+            "moves_per_s": round(stats.moves / seconds, 1),
+            "rejected_per_s": round(stats.rejected / seconds, 1),
+            "packets_in_per_s": round(stats.packets_out / seconds, 1),
+            "packets_out_per_s": round(stats.packets_in / seconds, 1),
+            "kbytes_out_per_s": round(stats.bytes_in / seconds / 1000, 1),
+            "update_p50_ms": round(percentile(update_ms, 50), 2),
+            "update_p95_ms": round(percentile(update_ms, 95), 2),
+            "update_p99_ms": round(percentile(update_ms, 99), 2),
+            "rtt_p50_ms": round(percentile(rtt_ms, 50), 2),
+            "rtt_p99_ms": round(percentile(rtt_ms, 99), 2),
+            "move_p50_ms": round(percentile(move_ms, 50), 2),
+            "move_p99_ms": round(percentile(move_ms, 99), 2),
+            "late_p99_ms": round(percentile(late_ms, 99), 2),
+        }
+        row["slipping"] = row["late_p99_ms"] > 500 / self.tick_rate
+        self.rows.append(row)
+        print(f"{clients:>7} {row['moves_per_s']:>8} {row['packets_in_per_s']:>8} {row['packets_out_per_s']:>9} "
+              f"{row['update_p50_ms']:>7.1f}/{row['update_p99_ms']:<7.1f} "
+              f"{row['rtt_p50_ms']:>7.1f}/{row['rtt_p99_ms']:<7.1f} {row['move_p50_ms']:>7.1f}/{row['move_p99_ms']:<7.1f} "
+              f"{row['late_p99_ms']:>8.1f}{'  SLIP' if row['slipping'] else ''}")
+
+    async def run(self):
+        args = self.args
+        print(f"{args.strategy} bots, {args.rate} clicks/s each, steps of {args.step} every {args.step_secs}s")
+        print(f"{'clients':>7} {'moves/s':>8} {'in pkt/s':>8} {'out pkt/s':>9} {'update p50/p99':>15} {'rtt p50/p99':>15} "
+              f"{'move p50/p99':>15} {'late p99':>8}")
+        while len(self.bots) < args.clients:
+            await self.add_bots(min(args.step, args.clients - len(self.bots)))
+            # The first part of a step is joining and syncing, measure the rest
+            await asyncio.sleep(min(1.0, args.step_secs / 4))
+            self.stats = Stats()
+            await asyncio.sleep(args.step_secs)
+            self.report(len(self.bots), args.step_secs)
+
+        slipped = next((row["clients"] for row in self.rows if row["slipping"]), None)
+        if slipped is None:
+            print(f"\nTick deadlines held up to {len(self.bots)} clients")
+        else:
+            print(f"\nTick deadlines start slipping at {slipped} clients")
+        for task in self.tasks:
+            task.cancel()
+        for bot in self.bots:
+            bot.transport.close()
+
+    def save_csv(self, filename):
+        if not self.rows:
+            return
+        with open(filename, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(self.rows[0]))
+            writer.writeheader()
+            writer.writerows(self.rows)
+        print(f"Saved {filename}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grid Clash headless load generator")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--clients", type=int, default=200, help="bots at the end of the ramp")
+    parser.add_argument("--step", type=int, default=20, help="bots added per step (keep it a multiple of 4)")
+    parser.add_argument("--step-secs", type=float, default=5.0, help="measured seconds per step")
+    parser.add_argument("--rate", type=float, default=5.0, help="clicks per second per bot")
+    parser.add_argument("--strategy", choices=STRATEGIES, default="random")
+    parser.add_argument("--tick-rate", type=float, default=TICK_RATE, help="the server's --tick-rate")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--spawn-server", action="store_true",
+                        help=f"start {SERVER_SCRIPT} --max-matches 0 for the run and stop it afterwards")
+    parser.add_argument("--server-args", default="", help="extra arguments for the spawned server, e.g. \"--rows 100 --cols 100\"")
+    parser.add_argument("--csv", default="load_test_metrics.csv")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn_server:
+        server = subprocess.Popen([sys.executable, SERVER_SCRIPT, "--max-matches", "0", "--port", str(args.port),
+                                   "--tick-rate", str(args.tick_rate)] + args.server_args.split(),
+                                  stdout=subprocess.DEVNULL)
+        time.sleep(2)
+    test = LoadTest(args)
+    try:
+        asyncio.run(test.run())
+    except KeyboardInterrupt:
+        print("\nStopping load test...")
+    finally:
+        test.save_csv(args.csv)
+        if server is not None:
+            server.terminate()
@@ -0,0 +1,470 @@
+import math
+import time
+import datetime
+from collections import deque
+from board import GameBoard, diff_snapshots
+from history import SnapshotHistory
+from acks import LossTracker, RttEstimator
+from metrics import (TICK_SECONDS, DIFF_SECONDS, ENCODE_SECONDS, SEND_SECONDS, PACKETS_SENT, BYTES_SENT,
+                     CLIENT_PACKETS_SENT, CLIENT_BYTES_SENT, ACK_LAG, client_label)
+from protocol import Packet, CODEC_JSON, MAX_EVENT_MOVES, encode_packet, decode_packet, negotiate_codec, packetize
+
+# ---------------- GAME STATE ----------------
+GRID_SIZE = 20
+MAX_PLAYERS = 4
+TICK_RATE = 20  # Hz
+HISTORY_SECONDS = 2.5  # how far back lagging clients can still get a delta
+MAX_VIEWPORT_SIDE = 128  # bounds the region snapshot a viewport change can trigger
+# Redundant deltas: each DELTA repeats the changes of the last N ticks, with N
+# picked so a tick is lost in every copy with at most REDUNDANCY_TARGET odds
+REDUNDANCY_TARGET = 0.001
+MIN_REDUNDANCY = 1
+MAX_REDUNDANCY = 16
+# Per-client update rate: a congested client (recent loss above
+# CONGESTION_LOSS, or SRTT more than QUEUE_DELAY above its best RTT) gets an
+# update only every 2nd, then 4th tick, and speeds back up once its loss drops
+# under RECOVERY_LOSS. Judged each time ADAPT_SAMPLES more updates are settled.
+MAX_UPDATE_INTERVAL = 4
+CONGESTION_LOSS = 0.15
+RECOVERY_LOSS = 0.05
+QUEUE_DELAY = 0.1
+ADAPT_SAMPLES = 40
+
+
+def redundancy_depth(loss_rate):
+    if loss_rate <= 0:
+        return MIN_REDUNDANCY
+    if loss_rate >= 1:
+        return MAX_REDUNDANCY
+    copies = math.ceil(math.log(REDUNDANCY_TARGET) / math.log(loss_rate))
+    return min(MAX_REDUNDANCY, max(MIN_REDUNDANCY, copies - 1))
+
+
+# ---------------- FAN-OUT CACHE ----------------
+# Clients that get the same update this tick (same message type, same delta
+# base, same viewport, same codec) are sent the very same bytes objects, which
+# are encoded only once. Entries live for a single tick.
+class FanoutCache:
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def begin_tick(self):
+        self.entries.clear()
+
+    def get(self, key, build):
+        datagrams = self.entries.get(key)
+        if datagrams is None:
+            self.misses += 1
+            datagrams = self.entries[key] = build()
+        else:
+            self.hits += 1
+        return datagrams
+
+
+# ---------------- MATCH ----------------
+# All game state and protocol logic for one match, independent of how datagrams
+# are received. The engine feeds it datagrams via handle_datagram() and calls
+# tick() at the broadcast rate; everything it sends goes through `send`, which
+# has the signature of socket.sendto / DatagramTransport.sendto. Sends, stage
+# timings and ACK lag are counted in the metrics registry (metrics.py).
+class Match:
+    def __init__(self, send, on_game_over=None, tick_rate=TICK_RATE, rows=GRID_SIZE, cols=GRID_SIZE):
+        self.send = send
+        self.on_game_over = on_game_over
+        self.match_id = 0
+        self.board = GameBoard(rows, cols)
+        self.playerScores = [0]*MAX_PLAYERS
+        self.addressList = []
+        self.gameScore = 0
+        self.gameOngoing = False
+        self.gameOver = False
+        self.seq_ID = 0
+        self.snapshotId = 0
+        self.client_acks = {}    # addr -> newest id the client's board is complete up to
+        self.client_latest = {}  # addr -> newest id the client received at all
+        self.client_loss = {}  # addr -> LossTracker built from the cumulative ACKs
+        self.client_rtt = {}       # addr -> RttEstimator
+        self.client_interval = {}  # addr -> ticks between updates
+        self.client_sent = {}      # addr -> ids of the last updates sent
+        self.client_marks = {}     # addr -> (settled, lost) at the last rate decision
+        self.sent_times = {}       # snapshot id -> server time it went out
+        self.recent_results = deque(maxlen=MAX_UPDATE_INTERVAL)  # (snapshot id, move results)
+        self.tick_interval = 1.0 / tick_rate
+        self.client_codecs = {}
+        self.history = SnapshotHistory.for_window(HISTORY_SECONDS, 1.0 / tick_rate, cols=cols)
+        # Area of interest: clients that declared a viewport only get changes
+        # inside it. view_since is the snapshot id of the region snapshot that
+        # (re)synced the viewport; deltas need an ack at or after it.
+        self.client_views = {}
+        self.view_since = {}
+        self.fanout = FanoutCache()
+        # (player, cells) move lists received since the last tick; only tick()
+        # writes the board
+        self.pending_moves = []
+        self.last_grid = None
+        self.last_version = -1
+        self.client_labels = {}  # addr -> "ip:port" label of its metrics series
+        self.encode_time = 0.0  # spent in build_update this tick
+
+    def handle_datagram(self, data, addr):
+        if self.gameOver:
+            return
+        if not self.gameOngoing:
+            self.handle_join(data, addr)
+        else:
+            self.handle_game_packet(data, addr)
+
+    # --- PHASE 1 + 2: WAITING FOR PLAYERS / START GAME ---
+    def handle_join(self, data, addr):
+        if addr not in self.addressList:
+            self.addressList.append(addr)
+            self.client_acks[addr] = -1
+            self.client_codecs[addr] = negotiate_codec(data)
+            self.client_labels[addr] = client_label(addr)
+            print(f"Player connected: {addr}")
+
+        remaining = MAX_PLAYERS - len(self.addressList)
+        for idx, a in enumerate(self.addressList):
+            payload = {"gameReady": 0, "message": f"Waiting for {remaining} players", "id": idx,
+                       "codec": self.client_codecs[a], "rows": self.board.rows, "cols": self.board.cols}
+            packet = Packet(1, "", "", self.seq_ID, time.monotonic(), 0, payload)
+            self.transmit(encode_packet(packet), a, "LOBBY")
+            self.seq_ID += 1 # FIX: Increment instead of toggle
+
+        if len(self.addressList) < MAX_PLAYERS:
+            return
+        print(f"Players connected: {len(self.addressList)}")
+
+        for idx, a in enumerate(self.addressList):
+            payload = {"gameReady": 1, "message": "Grid clash starting", "id": idx, "codec": self.client_codecs[a],
+                       "rows": self.board.rows, "cols": self.board.cols}
+            packet = Packet(1, "", "", self.seq_ID, time.monotonic(), 0, payload)
+            self.transmit(encode_packet(packet), a, "LOBBY")
+            self.seq_ID += 1 # FIX: Increment instead of toggle
+
+        self.gameOngoing = True
+        for a in self.addressList:
+            self.client_loss[a] = LossTracker()
+            self.client_rtt[a] = RttEstimator()
+            self.client_interval[a] = 1
+            self.client_sent[a] = deque(maxlen=MAX_REDUNDANCY + 1)
+        self.seq_ID = 0
+        print("Game started!")
+
+    # --- SIMULATION STEP (start of every tick) ---
+    def apply_moves(self):
+        # Applies the whole batch in arrival order: the first claim on a free
+        # cell wins, later claims in the same batch find it taken. A move list
+        # from one EVENT is applied as a unit, never interleaved with another.
+        # Returns one [player, r, c, ok] result per cell for the outgoing updates.
+        batch, self.pending_moves = self.pending_moves, []
+        results = []
+        for playerId, moves in batch:
+            for x, y in moves:
+                ok = self.board.get(x, y) == 0
+                if ok:
+                    self.board.set(x, y, playerId + 1)
+                    self.playerScores[playerId] += 1
+                    self.gameScore += 1
+                results.append([playerId + 1, x, y, int(ok)])
+        return results
+
+    def transmit(self, datagram, addr, msg_type):
+        self.send(datagram, addr)
+        size = len(datagram)
+        PACKETS_SENT.inc((msg_type,))
+        BYTES_SENT.inc((msg_type,), size)
+        label = (self.client_labels[addr],)
+        CLIENT_PACKETS_SENT.inc(label)
+        CLIENT_BYTES_SENT.inc(label, size)
+
+    # --- BROADCAST (one tick) ---
+    def tick(self):
+        if not self.gameOngoing:
+            return
+        tick_started = time.perf_counter()
+        results = self.apply_moves()
+
+        # --- GAME OVER CHECK ---
+        if self.gameScore >= len(self.board):
+            self.end_game(results)
+            return
+
+        board = self.board
+        snapshotId = self.snapshotId
+        diff_started = time.perf_counter()
+
+        # 1. Snapshot (flat buffer copy), skipped entirely when nothing was written
+        prev_id = snapshotId - 1
+        has_prev_diff = self.last_grid is not None
+        if has_prev_diff and board.version == self.last_version:
+            current_grid = self.last_grid
+            indices, values = [], []
+        else:
+            current_grid = board.snapshot()
+            self.last_version = board.version
+
+            # 2. Calculate Global Diff (Optimization)
+            indices, values = diff_snapshots(self.last_grid, current_grid) if has_prev_diff else ([], [])
+        latest_changes = board.to_changes(indices, values)
+        DIFF_SECONDS.observe(time.perf_counter() - diff_started)
+
+        # 3. Archive History (ring of keyframes + per-tick deltas)
+        self.history.record(snapshotId, current_grid, indices, values)
+        self.last_grid = current_grid
+
+        # 4. Send to each client: pick (type, base, viewport), encode once per group
+        self.fanout.begin_tick()
+        self.encode_time = send_time = 0.0
+        stamp = datetime.datetime.now().isoformat()
+        server_ts = time.monotonic()
+        self.sent_times[snapshotId] = server_ts
+        self.sent_times.pop(snapshotId - self.history.capacity, None)
+        self.recent_results.append((snapshotId, results))
+        for addr in self.addressList:
+            # Rate adaptation: congested clients only get every Nth tick
+            if snapshotId % self.client_interval[addr]:
+                continue
+            sent = self.client_sent[addr]
+            results_since = sent[-1] if sent else -1
+            last_acked_id = self.client_acks.get(addr, -1)
+            view = self.client_views.get(addr)
+
+            if view is not None:
+                key = self.viewport_key(addr, view, last_acked_id)
+
+            # Strategy A: Delta from Previous Frame
+            elif has_prev_diff and last_acked_id == prev_id:
+                key = ("DELTA", prev_id, None)
+
+            # Strategy B: Redundant Delta (last N ticks), or from the acked base (Lag Compensation)
+            elif self.history.covers(last_acked_id):
+                key = ("DELTA", self.delta_base(addr, last_acked_id), None)
+
+            # Strategy C: Full Snapshot (Fallback)
+            else:
+                key = ("SNAPSHOT", None, None)
+
+            codec = self.client_codecs.get(addr, CODEC_JSON)
+            try:
+                datagrams = self.fanout.get(key + (codec, results_since), lambda: self.build_update(
+                    key, codec, current_grid, latest_changes, prev_id, stamp, server_ts,
+                    self.results_since(results_since)))
+                send_started = time.perf_counter()
+                for datagram in datagrams:
+                    self.transmit(datagram, addr, key[0])
+                send_time += time.perf_counter() - send_started
+            except Exception:
+                pass
+            sent.append(snapshotId)
+            if snapshotId > 0:  # clients never ack snapshot 0
+                self.client_loss[addr].on_sent(snapshotId)
+
+        self.seq_ID += 1 # FIX: Increment instead of toggle (1 - seq_ID)
+        self.snapshotId += 1
+        ENCODE_SECONDS.observe(self.encode_time)
+        SEND_SECONDS.observe(send_time)
+        TICK_SECONDS.observe(time.perf_counter() - tick_started)
+
+    def results_since(self, since):
+        # Move results of every tick after `since`, so clients that skip ticks
+        # still see them
+        return [r for sid, results in self.recent_results if sid > since for r in results]
+
+    def delta_base(self, addr, last_acked_id):
+        # A delta from the acked base is always safe but repeats every update
+        # since that ack, i.e. a whole RTT of changes. Only the last N updates
+        # are repeated instead, N following the client's loss rate, until the
+        # client reports a hole (it received a newer id than it is complete up
+        # to) and gets everything since its acked base again.
+        if self.client_latest.get(addr, -1) > last_acked_id:
+            return last_acked_id
+        sent = self.client_sent[addr]
+        depth = self.redundancy(addr)
+        if len(sent) <= depth:
+            return last_acked_id
+        return max(last_acked_id, sent[-depth - 1])
+
+    def redundancy(self, addr):
+        tracker = self.client_loss.get(addr)
+        depth = redundancy_depth(tracker.loss_rate() if tracker else 0.0)
+        rtt = self.client_rtt.get(addr)
+        if rtt is not None and rtt.srtt is not None:
+            # Copies older than about one RTO are pointless: by then the
+            # client's hole report has brought the same repair
+            period = self.client_interval[addr] * self.tick_interval
+            depth = min(depth, max(MIN_REDUNDANCY, math.ceil(rtt.rto() / period)))
+        return depth
+
+    def adapt_rate(self, addr):
+        tracker = self.client_loss[addr]
+        settled = tracker.received + tracker.lost
+        marked_settled, marked_lost = self.client_marks.get(addr, (0, 0))
+        if settled - marked_settled < ADAPT_SAMPLES:
+            return
+        loss = (tracker.lost - marked_lost) / (settled - marked_settled)
+        rtt = self.client_rtt[addr]
+        queued = rtt.srtt is not None and rtt.srtt - rtt.min_rtt > QUEUE_DELAY
+        interval = self.client_interval[addr]
+        if (loss > CONGESTION_LOSS or queued) and interval < MAX_UPDATE_INTERVAL:
+            interval *= 2
+        elif loss < RECOVERY_LOSS and not queued and interval > 1:
+            interval //= 2
+        self.client_interval[addr] = interval
+        self.client_marks[addr] = (settled, tracker.lost)
+
+    def viewport_key(self, addr, view, last_acked_id):
+        since = self.view_since.get(addr)
+        if since is not None and last_acked_id >= since and self.history.covers(last_acked_id):
+            return ("DELTA", last_acked_id, view)
+
+        # New viewport, or its last sync was lost / aged out: resend the region
+        if since is None or not self.history.covers(since):
+            self.view_since[addr] = self.snapshotId
+        return ("SNAPSHOT", None, view)
+
+    def build_update(self, key, codec, current_grid, latest_changes, prev_id, stamp, server_ts, results):
+        started = time.perf_counter()
+        msg_type, base, view = key
+        if msg_type == "DELTA":
+            if base == prev_id and view is None:
+                changes = latest_changes
+            else:
+                # Merges the per-tick deltas since the base instead of rescanning the board
+                changes = self.board.to_changes(*self.history.changes_since(base, view))
+            payload_data = {"Changes": changes, "Base": base, "gameOngoing": self.gameOngoing, "timestamp": stamp}
+        elif view is None:
+            payload_data = {"Message": "Live Update", "Grid": self.board.to_rows(current_grid),
+                            "gameOngoing": self.gameOngoing, "timestamp": stamp}
+        else:
+            payload_data = {"Message": "Live Update", "Grid": self.board.region_rows(current_grid, view),
+                            "Origin": [view[0], view[1]], "gameOngoing": self.gameOngoing, "timestamp": stamp}
+        if results:
+            # This tick's move results ride along instead of one INFO per move
+            payload_data["Results"] = results
+
+        packet = Packet(1, msg_type, self.snapshotId, self.seq_ID, server_ts, 0, payload_data)
+        # Oversized snapshots/deltas go out as independently applicable parts
+        datagrams = packetize(packet, codec)
+        self.encode_time += time.perf_counter() - started
+        return datagrams
+
+    # --- PHASE 3: GAME LOOP ---
+    def handle_game_packet(self, data, addr):
+        try:
+            msg = decode_packet(data)
+            req_type = msg.get('msg_type')
+
+            # Handle ACKs (Critical for Delta Encoding)
+            if req_type == 'ACK':
+                acked_id = msg.get("snapshot_id")
+                if acked_id is not None:
+                    payload = msg.get("payload", {})
+                    self.handle_ack(addr, acked_id, payload.get("Bits", 0), payload.get("Synced"), payload.get("Hold", 0))
+                return
+
+            if req_type == 'VIEWPORT':
+                r0, c0, h, w = msg["payload"]["Rect"]
+                self.client_views[addr] = self.board.clamp_rect(r0, c0, h, w, MAX_VIEWPORT_SIDE)
+                self.view_since.pop(addr, None)
+                return
+
+            if req_type == 'EVENT':
+                payload = msg.get("payload", "")
+                if isinstance(payload, str):
+                    # Single move from an older client: "x,y,id"
+                    x, y, playerId = map(int, payload.split(","))
+                    moves = [(x, y)]
+                else:
+                    if "Ack" in payload:
+                        self.handle_ack(addr, *payload["Ack"])
+                    playerId = payload["id"]
+                    moves = [(int(x), int(y)) for x, y in payload["Moves"]]
+                # The list is accepted or rejected as a whole
+                if not 0 <= playerId < MAX_PLAYERS or not 0 < len(moves) <= MAX_EVENT_MOVES:
+                    return
+                if not all(self.board.in_bounds(x, y) for x, y in moves):
+                    return
+                # Applied by the next tick, see apply_moves()
+                self.pending_moves.append((playerId, moves))
+
+        except Exception:
+            return
+
+    def handle_ack(self, addr, acked_id, bits, synced=None, hold_ms=0):
+        # Older clients only ack ids their board is complete up to
+        synced = acked_id if synced is None else synced
+        if synced > self.client_acks.get(addr, -1):
+            self.client_acks[addr] = synced
+        fresh = acked_id > self.client_latest.get(addr, -1)
+        if fresh:
+            self.client_latest[addr] = acked_id
+            if 0 < acked_id < self.snapshotId:
+                ACK_LAG.observe(self.snapshotId - 1 - acked_id)
+        tracker = self.client_loss.get(addr)
+        if tracker is None or not 0 < acked_id < self.snapshotId:
+            return
+        # Only the first ACK of an id gives an RTT sample; the time the client
+        # held it before acking is not part of the path
+        if fresh and acked_id in self.sent_times:
+            self.client_rtt[addr].sample(time.monotonic() - self.sent_times[acked_id] - hold_ms / 1000)
+        tracker.on_ack(acked_id, bits)
+        self.adapt_rate(addr)
+
+    def client_stats(self):
+        # Per-client loss and RTT picture, one dict per player
+        def ms(seconds):
+            return round(seconds * 1000, 3) if seconds is not None else ""
+
+        stats = []
+        for idx, addr in enumerate(self.addressList):
+            tracker = self.client_loss.get(addr)
+            if tracker is None:
+                continue
+            rtt = self.client_rtt[addr]
+            stats.append({"match_id": self.match_id, "player": idx + 1, "addr": f"{addr[0]}:{addr[1]}",
+                          "acked_id": self.client_acks.get(addr, -1), "snapshots_received": tracker.received,
+                          "snapshots_lost": tracker.lost, "recent_loss_pct": round(tracker.loss_rate() * 100, 2),
+                          "redundancy": self.redundancy(addr), "update_interval_ticks": self.client_interval[addr],
+                          "srtt_ms": ms(rtt.srtt), "rttvar_ms": ms(rtt.rttvar), "min_rtt_ms": ms(rtt.min_rtt),
+                          "rtt_samples": rtt.samples})
+        return stats
+
+    def close(self, reason):
+        # Ends the match without a winner; an INFO with gameOngoing False tells
+        # every player it is over instead of leaving them waiting for updates
+        self.gameOngoing = False
+        self.gameOver = True
+        payload = {"Message": reason, "gameOngoing": False, "timestamp": time.monotonic()}
+        for a in self.addressList:
+            packet = Packet(1, "INFO", -1, self.seq_ID, time.monotonic(), 0, payload)
+            self.transmit(encode_packet(packet, self.client_codecs.get(a, CODEC_JSON)), a, "INFO")
+
+    def end_game(self, results=None):
+        self.gameOngoing = False
+        self.gameOver = True
+
+        maxScore = max(self.playerScores)
+        winnerIndex = self.playerScores.index(maxScore)
+        final_payload = {"Message": f"Player {winnerIndex+1} WON!", "Grid": self.board.to_rows(),
+                         "gameOngoing": False, "timestamp": time.monotonic()}
+        if results:
+            final_payload["Results"] = results
+
+        # Same board for everyone, so encode it once per codec
+        packet = Packet(1, "SNAPSHOT", self.snapshotId, self.seq_ID, time.monotonic(), 0, final_payload)
+        datagrams = {}
+        for a in self.addressList:
+            codec = self.client_codecs.get(a, CODEC_JSON)
+            if codec not in datagrams:
+                datagrams[codec] = packetize(packet, codec)
+            for datagram in datagrams[codec]:
+                self.transmit(datagram, a, "SNAPSHOT")
+
+        print(f"GAME OVER. Player {winnerIndex+1} won.")
+        # Only after the final board is out: the host may close the socket
+        # as soon as the last match reports finished
+        if self.on_game_over:
+            self.on_game_over()
@@ -0,0 +1,130 @@
+import time
+from match import Match, GRID_SIZE, TICK_RATE
+from metrics import REGISTRY, PACKETS_SENT, BYTES_SENT, forget_client
+from protocol import is_ping, pong_message
+
+# ---------------- MATCH MANAGER ----------------
+# Hosts many independent matches in one process. New clients saying "Hello"
+# fill the current lobby; once it has MAX_PLAYERS the match starts and the next
+# Hello opens a fresh lobby. Every match keeps its own board, history and ACK
+# state, and one shared scheduler calls tick() which only visits running
+# matches. Finished matches, and running matches nobody has talked to for
+# ROOM_IDLE_TIMEOUT seconds, are dropped so they cost nothing afterwards. The
+# lobby is never reaped: its players send one Hello and then wait silently.
+
+ROOM_IDLE_TIMEOUT = 30.0
+
+
+class MatchManager:
+    def __init__(self, send=None, max_matches=1, on_all_finished=None,
+                 tick_rate=TICK_RATE, rows=GRID_SIZE, cols=GRID_SIZE):
+        self.send = send
+        self.max_matches = max_matches  # 0 = keep hosting forever
+        self.on_all_finished = on_all_finished
+        self.tick_rate = tick_rate
+        self.rows, self.cols = rows, cols
+        self.lobby = None
+        self.running = []
+        self.by_addr = {}
+        self.matches_created = 0
+        self.matches_finished = 0
+        self.fanout_hits = 0  # totals of finished matches; running ones are added in stats()
+        self.fanout_misses = 0
+        self.finished_clients = []  # client_stats() rows of finished matches
+        REGISTRY.gauge("gridclash_matches_running", "Matches being ticked", lambda: len(self.running))
+        REGISTRY.gauge("gridclash_players", "Clients in a lobby or running match", lambda: len(self.by_addr))
+        REGISTRY.gauge("gridclash_history_snapshots", "Snapshots retained in the delta history of all running matches",
+                       lambda: sum(len(m.history) for m in list(self.running)))
+        REGISTRY.gauge("gridclash_history_bytes", "Bytes held by the delta history of all running matches",
+                       lambda: sum(m.history.nbytes() for m in list(self.running)))
+
+    @property
+    def done(self):
+        return (self.max_matches and self.matches_finished >= self.max_matches
+                and self.lobby is None and not self.running)
+
+    def _new_lobby(self):
+        match = Match(self._send, tick_rate=self.tick_rate, rows=self.rows, cols=self.cols)
+        match.match_id = self.matches_created
+        match.last_activity = time.monotonic()
+        match.on_game_over = lambda: self._finish(match)
+        self.matches_created += 1
+        return match
+
+    def _send(self, data, addr):
+        self.send(data, addr)
+
+    def handle_datagram(self, data, addr, received_at=None):
+        # PINGs are answered right away from any address, before match routing,
+        # so clock sync never counts as a join or as activity in a lobby
+        if is_ping(data):
+            self.answer_ping(data, addr, time.monotonic() if received_at is None else received_at)
+            return
+        match = self.by_addr.get(addr)
+        if match is None:
+            if not data.startswith(b"Hello"):
+                return
+            if self.lobby is None:
+                if self.max_matches and self.matches_created >= self.max_matches:
+                    return
+                self.lobby = self._new_lobby()
+            match = self.lobby
+            self.by_addr[addr] = match
+
+        match.last_activity = time.monotonic()
+        match.handle_datagram(data, addr)
+
+        if match is self.lobby and match.gameOngoing:
+            print(f"Match {match.match_id} started ({len(self.running) + 1} running)")
+            self.lobby = None
+            self.running.append(match)
+
+    def answer_ping(self, data, addr, received_at):
+        try:
+            pong = pong_message(data, received_at, time.monotonic())
+        except Exception:
+            return
+        self.send(pong, addr)
+        PACKETS_SENT.inc(("PONG",))
+        BYTES_SENT.inc(("PONG",), len(pong))
+
+    def tick(self):
+        # A tick can end its match (and drop it from running), so iterate a copy
+        for match in list(self.running):
+            match.tick()
+
+    def reap_idle(self, now=None):
+        now = time.monotonic() if now is None else now
+        for match in list(self.running):
+            if now - match.last_activity > ROOM_IDLE_TIMEOUT:
+                print(f"Match {match.match_id} idle for {ROOM_IDLE_TIMEOUT:.0f}s, closing")
+                match.close(f"Match closed: no activity for {ROOM_IDLE_TIMEOUT:.0f}s")
+                self._finish(match)
+
+    def _finish(self, match):
+        if match in self.running:
+            self.running.remove(match)
+        if match is self.lobby:
+            self.lobby = None
+        for addr in match.addressList:
+            if self.by_addr.get(addr) is match:
+                del self.by_addr[addr]
+            forget_client(addr)
+        self.matches_finished += 1
+        self.fanout_hits += match.fanout.hits
+        self.fanout_misses += match.fanout.misses
+        self.finished_clients.extend(match.client_stats())
+        if self.done and self.on_all_finished:
+            self.on_all_finished(self)
+
+    def stats(self):
+        return {"lobbies": 1 if self.lobby else 0, "running": len(self.running),
+                "finished": self.matches_finished, "players": len(self.by_addr),
+                "fanout_hits": self.fanout_hits + sum(m.fanout.hits for m in self.running),
+                "fanout_misses": self.fanout_misses + sum(m.fanout.misses for m in self.running)}
+
+    def client_stats(self):
+        rows = list(self.finished_clients)
+        for match in self.running:
+            rows.extend(match.client_stats())
+        return rows
@@ -0,0 +1,245 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ---------------- METRICS REGISTRY ----------------
+# Live server telemetry in constant memory: histograms keep fixed buckets
+# (count, sum and max on top), counters one number per label value, and
+# gauges (or callback counters, for totals kept elsewhere) are read from a
+# callback when scraped. A running server exposes it
+#   - over HTTP on localhost: /metrics (Prometheus text) and /metrics.json
+#   - as a JSON line appended to a file every few seconds, when asked for
+# so a match can be watched while it runs instead of read back from one CSV
+# row after it ended. Everything here is safe to update from the tick thread
+# while the HTTP thread reads it.
+
+TIME_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+ACK_LAG_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 48, 64)
+PERCENT_BUCKETS = (1, 2, 5, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100, 200, 400)
+METRICS_PORT = 12100  # next to the game's 12000/12001; 9100 is node_exporter's
+SNAPSHOT_INTERVAL = 5.0  # seconds between JSON lines
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # label values -> total
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def remove(self, labels):
+        with self.lock:
+            self.values.pop(labels, None)
+
+    def items(self):
+        with self.lock:
+            return sorted(self.values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self.items():
+            lines.append(f"{self.name}{_label_text(self.labelnames, labels)} {value}")
+        return lines
+
+    def snapshot(self):
+        if not self.labelnames:
+            return self.values.get((), 0)
+        return {",".join(map(str, labels)): value for labels, value in self.items()}
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = None
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation (the max for +Inf)
+        with self.lock:
+            counts, total, top = list(self.counts), self.count, self.max
+        if not total:
+            return 0.0
+        rank, seen = q * total, 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.buckets[i], top) if i < len(self.buckets) else top
+        return top
+
+    def render(self):
+        with self.lock:
+            counts, total, value_sum = list(self.counts), self.count, self.sum
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        seen = 0
+        for bound, n in zip(self.buckets, counts):
+            seen += n
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {seen}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {total}')
+        lines.append(f"{self.name}_sum {value_sum}")
+        lines.append(f"{self.name}_count {total}")
+        return lines
+
+    def snapshot(self):
+        return {"count": self.count, "mean": self.mean(), "max": self.max or 0.0,
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99)}
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help = help_text
+        self.read = read
+
+    def value(self):
+        try:
+            return self.read()
+        except Exception:
+            return 0
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {self.value()}"]
+
+    def snapshot(self):
+        return self.value()
+
+
+class CallbackCounter(Gauge):
+    # A monotonic total owned by someone else (e.g. the tick scheduler), read
+    # when scraped but typed as a counter so rate() and resets work on it
+    kind = "counter"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}  # name -> metric, in registration order
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.metrics.setdefault(name, Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, buckets=TIME_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(name, help_text, buckets))
+
+    def gauge(self, name, help_text, read):
+        # Re-registering replaces the callback (e.g. a new MatchManager)
+        gauge = self.metrics[name] = Gauge(name, help_text, read)
+        return gauge
+
+    def callback_counter(self, name, help_text, read):
+        # Replaced on re-registration like gauges
+        counter = self.metrics[name] = CallbackCounter(name, help_text, read)
+        return counter
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        return {"time": time.time(), **{name: metric.snapshot() for name, metric in list(self.metrics.items())}}
+
+
+REGISTRY = Registry()
+
+# --- SERVER METRICS (updated by match.py and the server engines) ---
+TICK_SECONDS = REGISTRY.histogram("gridclash_tick_seconds", "Total time of one match tick")
+DIFF_SECONDS = REGISTRY.histogram("gridclash_tick_diff_seconds", "Board snapshot and diff per tick")
+ENCODE_SECONDS = REGISTRY.histogram("gridclash_tick_encode_seconds", "Building and encoding updates per tick")
+SEND_SECONDS = REGISTRY.histogram("gridclash_tick_send_seconds", "Socket sends per tick")
+PACKETS_SENT = REGISTRY.counter("gridclash_packets_sent_total", "Datagrams sent by message type", ("type",))
+BYTES_SENT = REGISTRY.counter("gridclash_bytes_sent_total", "Bytes sent by message type", ("type",))
+CLIENT_PACKETS_SENT = REGISTRY.counter("gridclash_client_packets_sent_total", "Datagrams sent per client", ("client",))
+CLIENT_BYTES_SENT = REGISTRY.counter("gridclash_client_bytes_sent_total", "Bytes sent per client", ("client",))
+ACK_LAG = REGISTRY.histogram("gridclash_ack_lag_ticks", "Ticks between the newest snapshot and the one a fresh ACK names",
+                             ACK_LAG_BUCKETS)
+CPU_PERCENT = REGISTRY.histogram("gridclash_process_cpu_percent", "Sampled server process CPU %", PERCENT_BUCKETS)
+
+
+def client_label(addr):
+    return f"{addr[0]}:{addr[1]}"
+
+def forget_client(addr):
+    # Per-client series end with the client's match, so they stay bounded
+    label = (client_label(addr),)
+    CLIENT_PACKETS_SENT.remove(label)
+    CLIENT_BYTES_SENT.remove(label)
+
+
+# ---------------- EXPORT ----------------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, kind = self.registry.render().encode(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, kind = json.dumps(self.registry.snapshot()).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_http(port=METRICS_PORT, registry=REGISTRY):
+    # Daemon thread; returns None when the port is taken so the game still runs
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    except OSError as e:
+        print(f"Metrics endpoint disabled ({e})")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics on http://127.0.0.1:{port}/metrics")
+    return server
+
+def write_snapshots(path, interval=SNAPSHOT_INTERVAL, registry=REGISTRY):
+    # Appends one JSON line per interval from a daemon thread. The file is
+    # emptied first so each server run starts its own series
+    open(path, "w").close()
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            with open(path, "a") as f:
+                f.write(json.dumps(registry.snapshot()) + "\n")
+
+    threading.Thread(target=loop, daemon=True).start()
@@ -0,0 +1,248 @@
+import asyncio
+import argparse
+import csv
+import random
+import signal
+import time
+from collections import Counter
+
+# ---------------- UDP IMPAIRMENT PROXY ----------------
+# A relay between the clients and the server on localhost that does what the
+# external `tc netem` shaping did for the Baseline / Delay100ms / Loss_2% /
+# Loss_5% runs, but seeded and in-process, so a scenario replays the same way
+# on any machine. Clients talk to --listen; each client gets its own upstream
+# socket, so the server still sees one address per player.
+#
+# Every datagram goes through the Link of its direction ("up" client ->
+# server, "down" server -> client; like netem on the loopback device both
+# directions are impaired):
+#   loss       - independent drops, or Gilbert-Elliott bursts (--ge-p/--ge-r)
+#   delay      - fixed delay plus uniform +-jitter (jitter alone reorders)
+#   reorder    - that fraction skips the delay and overtakes earlier packets
+#   duplicate  - that fraction is sent twice
+#   rate       - bandwidth cap with a bounded queue (tail drop beyond queue-ms)
+# What happened to each datagram can be written to --log as CSV; totals are
+# printed every --report seconds and on exit.
+
+LISTEN_PORT = 12000
+SERVER_PORT = 12001
+MAX_DATAGRAM = 65535
+
+# The recorded result folders and the file prefix their CSVs use
+SCENARIOS = {
+    "Baseline": {"prefix": "baseline_"},
+    "Delay100ms": {"prefix": "100ms_", "delay_ms": 100},
+    "Loss_2%": {"prefix": "loss_2%_", "loss": 0.02},
+    "Loss_5%": {"prefix": "loss_5%_", "loss": 0.05},
+}
+LINK_OPTIONS = ("loss", "ge_p", "ge_r", "ge_loss_good", "ge_loss_bad", "delay_ms", "jitter_ms",
+                "reorder", "duplicate", "rate_kbps", "queue_ms")
+
+
+class Link:
+    # Impairments of one direction, with its own seeded random stream
+    def __init__(self, seed, loss=0.0, ge_p=0.0, ge_r=1.0, ge_loss_good=0.0, ge_loss_bad=1.0,
+                 delay_ms=0.0, jitter_ms=0.0, reorder=0.0, duplicate=0.0, rate_kbps=0.0, queue_ms=200.0):
+        self.rng = random.Random(seed)
+        self.loss = loss
+        # Gilbert-Elliott: p = P(good -> bad), r = P(bad -> good) per packet,
+        # each state with its own loss probability. Mean burst = 1 / r packets.
+        self.ge = (ge_p, ge_r, ge_loss_good, ge_loss_bad) if ge_p > 0 else None
+        self.bad = False
+        self.delay = delay_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.reorder = reorder
+        self.duplicate = duplicate
+        self.rate = rate_kbps * 1000 / 8  # bytes per second, 0 = unlimited
+        self.queue = queue_ms / 1000
+        self.busy_until = 0.0  # when the capped link has sent everything queued
+        self.counts = Counter()
+
+    def lost(self):
+        if self.ge is None:
+            return self.rng.random() < self.loss
+        p, r, loss_good, loss_bad = self.ge
+        self.bad = self.rng.random() >= r if self.bad else self.rng.random() < p
+        return self.rng.random() < (loss_bad if self.bad else loss_good)
+
+    def process(self, size, now):
+        # (action, delay in seconds) for every copy that will be delivered
+        self.counts["packets"] += 1
+        self.counts["bytes"] += size
+        if self.lost():
+            self.counts["lost"] += 1
+            return [("lost", None)]
+        copies = 2 if self.rng.random() < self.duplicate else 1
+        if copies == 2:
+            self.counts["duplicated"] += 1
+        out = []
+        for _ in range(copies):
+            action, delay = "sent", self.delay
+            if self.jitter:
+                delay = max(0.0, delay + self.rng.uniform(-self.jitter, self.jitter))
+            if self.reorder and delay > 0 and self.rng.random() < self.reorder:
+                action, delay = "reordered", 0.0
+                self.counts["reordered"] += 1
+            if self.rate:
+                start = max(now, self.busy_until)
+                if start - now > self.queue:
+                    self.counts["queue_dropped"] += 1
+                    out.append(("queue_dropped", None))
+                    continue
+                self.busy_until = start + size / self.rate
+                delay += self.busy_until - now
+            self.counts["delivered"] += 1
+            self.counts["delay_ms_total"] += delay * 1000
+            out.append((action, delay))
+        return out
+
+    def summary(self):
+        c = self.counts
+        delivered = c["delivered"]
+        return {"packets": c["packets"], "delivered": delivered, "lost": c["lost"],
+                "loss_pct": round(100 * c["lost"] / c["packets"], 2) if c["packets"] else 0.0,
+                "queue_dropped": c["queue_dropped"], "duplicated": c["duplicated"], "reordered": c["reordered"],
+                "avg_delay_ms": round(c["delay_ms_total"] / delivered, 2) if delivered else 0.0,
+                "kbytes": round(c["bytes"] / 1000, 1)}
+
+
+# ---------------- RELAY ----------------
+class Upstream(asyncio.DatagramProtocol):
+    # The proxy's socket towards the server for one client
+    def __init__(self, proxy, client):
+        self.proxy = proxy
+        self.client = client
+        self.transport = None
+        self.backlog = []  # datagrams due before the socket was ready
+
+    def connection_made(self, transport):
+        self.transport = transport
+        for data in self.backlog:
+            transport.sendto(data)
+        self.backlog = []
+
+    def datagram_received(self, data, addr):
+        self.proxy.relay(data, "down", self.client)
+
+    def sendto(self, data):
+        if self.transport is None:
+            self.backlog.append(data)
+        else:
+            self.transport.sendto(data)
+
+
+class ImpairmentProxy(asyncio.DatagramProtocol):
+    def __init__(self, server, links, log_path=None):
+        self.server = server
+        self.links = links  # {"up": Link, "down": Link}
+        self.transport = None
+        self.upstreams = {}
+        self.started = time.monotonic()
+        self.log_file = open(log_path, "w", newline="") if log_path else None
+        self.log = csv.writer(self.log_file) if self.log_file else None
+        if self.log:
+            self.log.writerow(["time_s", "direction", "client", "bytes", "action", "delay_ms"])
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if addr not in self.upstreams:
+            upstream = self.upstreams[addr] = Upstream(self, addr)
+            asyncio.get_running_loop().create_task(asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: upstream, remote_addr=self.server))
+        self.relay(data, "up", addr)
+
+    def relay(self, data, direction, client):
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        for action, delay in self.links[direction].process(len(data), now):
+            if self.log:
+                self.log.writerow([round(now - self.started, 6), direction, f"{client[0]}:{client[1]}", len(data),
+                                   action, "" if delay is None else round(delay * 1000, 3)])
+            if delay is None:
+                continue
+            if delay > 0:
+                loop.call_later(delay, self.deliver, data, direction, client)
+            else:
+                self.deliver(data, direction, client)
+
+    def deliver(self, data, direction, client):
+        if direction == "up":
+            self.upstreams[client].sendto(data)
+        else:
+            self.transport.sendto(data, client)
+
+    def report(self):
+        for direction, link in self.links.items():
+            stats = link.summary()
+            print(f"[proxy] {direction:<4} " + " ".join(f"{k}={v}" for k, v in stats.items()), flush=True)
+
+    def close(self):
+        for upstream in self.upstreams.values():
+            if upstream.transport is not None:
+                upstream.transport.close()
+        if self.log_file:
+            self.log_file.close()
+
+
+async def run_proxy(listen_port, server, links, log_path=None, report_every=5.0):
+    loop = asyncio.get_running_loop()
+    transport, proxy = await loop.create_datagram_endpoint(
+        lambda: ImpairmentProxy(server, links, log_path), local_addr=("127.0.0.1", listen_port))
+    print(f"Impairment proxy on UDP {listen_port} -> {server[0]}:{server[1]}", flush=True)
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), report_every)
+            except asyncio.TimeoutError:
+                proxy.report()
+    finally:
+        proxy.report()
+        proxy.close()
+        transport.close()
+
+
+def make_links(options, seed):
+    # Same settings both ways, independent random streams per direction
+    return {"up": Link(seed * 2, **options), "down": Link(seed * 2 + 1, **options)}
+
+
+def scenario_options(name):
+    return {k: v for k, v in SCENARIOS[name].items() if k in LINK_OPTIONS}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seeded UDP loss/delay/jitter proxy for Grid Clash")
+    parser.add_argument("--listen", type=int, default=LISTEN_PORT, help="port the clients send to")
+    parser.add_argument("--server-host", default="127.0.0.1")
+    parser.add_argument("--server-port", type=int, default=SERVER_PORT)
+    parser.add_argument("--scenario", choices=list(SCENARIOS), help="preset; explicit options below override it")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--loss", type=float, help="independent loss probability (0.02 = 2%%)")
+    parser.add_argument("--ge-p", type=float, help="Gilbert-Elliott P(good -> bad) per packet")
+    parser.add_argument("--ge-r", type=float, help="Gilbert-Elliott P(bad -> good) per packet")
+    parser.add_argument("--ge-loss-good", type=float, help="loss probability in the good state (default 0)")
+    parser.add_argument("--ge-loss-bad", type=float, help="loss probability in the bad state (default 1)")
+    parser.add_argument("--delay-ms", type=float, help="fixed one-way delay per direction")
+    parser.add_argument("--jitter-ms", type=float, help="uniform +- jitter on top of the delay")
+    parser.add_argument("--reorder", type=float, help="fraction of packets that skip the delay")
+    parser.add_argument("--duplicate", type=float, help="fraction of packets sent twice")
+    parser.add_argument("--rate-kbps", type=float, help="bandwidth cap per direction (0 = none)")
+    parser.add_argument("--queue-ms", type=float, help="queue behind the cap before tail drop (default 200)")
+    parser.add_argument("--log", help="CSV of every datagram and what was done to it")
+    parser.add_argument("--report", type=float, default=5.0, help="seconds between printed totals")
+    args = parser.parse_args()
+
+    options = scenario_options(args.scenario) if args.scenario else {}
+    for name in LINK_OPTIONS:
+        if getattr(args, name) is not None:
+            options[name] = getattr(args, name)
+    links = make_links(options, args.seed)
+    asyncio.run(run_proxy(args.listen, (args.server_host, args.server_port), links, args.log, args.report))
@@ -0,0 +1,460 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import struct
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import Counter
+from protocol import decode_packet
+
+# ---------------- PCAPNG TRACE REPLAY ----------------
+# Turns a capture of a real match (game-trace.pcapng) into a repeatable
+# server workload, without Wireshark or any capture library:
+#   read_pcapng     walks the pcapng blocks (either byte order, any timestamp
+#                   resolution, several interfaces) and yields link frames
+#   udp_datagrams   unwraps loopback / Ethernet / Linux cooked / raw IP
+#                   frames down to UDP, IPv4 and IPv6
+#   Replayer        sends the client -> server datagrams to a live server with
+#                   their recorded spacing (real time), N times faster, or
+#                   back to back; every captured client address gets its own
+#                   local socket, so the server sees as many players as were
+#                   recorded, and what the server sends back is counted
+#   replay_in_process  the same datagrams fed to a MatchManager in virtual
+#                   time, for a deterministic cost per datagram and per tick
+#
+# The recorded ACKs name the snapshot ids of the recorded match, so they only
+# line up with the server's ticks when its tick rate is scaled with --speed;
+# a spawned server is started that way unless --tick-rate says otherwise.
+#
+#   python pcap_replay.py game-trace.pcapng --info
+#   python pcap_replay.py game-trace.pcapng --speed 4 --spawn-server
+#   python pcap_replay.py game-trace.pcapng --speed 0 --port 12001
+
+SERVER_SCRIPT = "server+gui+delta.py"
+SERVER_PORT = 12000
+SETTLE_SECS = 1.0  # replies still counted after the last datagram went out
+
+# Block types and link types this reader understands
+BLOCK_SHB = 0x0A0D0D0A
+BLOCK_IDB = 0x00000001
+BLOCK_PB = 0x00000002  # obsolete Packet Block
+BLOCK_SPB = 0x00000003
+BLOCK_EPB = 0x00000006
+BYTE_ORDER_MAGIC = 0x1A2B3C4D
+OPT_IF_TSRESOL = 9
+LINK_NULL = 0  # BSD loopback, address family in the capturing host's byte order
+LINK_ETHERNET = 1
+LINK_RAW = (12, 14, 101)
+LINK_LOOP = 108  # OpenBSD loopback, family in network byte order
+LINK_SLL = 113
+LINK_SLL2 = 276
+AF_INET6_NULL = (10, 24, 28, 30)  # AF_INET6 on Linux, BSD, FreeBSD, macOS
+
+
+class PcapError(Exception):
+    pass
+
+
+# ---------------- PCAPNG ----------------
+def _options(data, endian):
+    # {code: value} of a block's TLV options
+    options, pos = {}, 0
+    while pos + 4 <= len(data):
+        code, length = struct.unpack_from(endian + "HH", data, pos)
+        if code == 0:
+            break
+        options[code] = data[pos + 4:pos + 4 + length]
+        pos += 4 + (length + 3) // 4 * 4
+    return options
+
+def _ts_unit(tsresol):
+    # if_tsresol: power of 10 (top bit clear) or of 2 (top bit set); default microseconds
+    if tsresol is None:
+        return 1e-6
+    value = tsresol[0]
+    return 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+
+def read_pcapng(path):
+    # Yields (timestamp seconds or None, link type, frame bytes) per packet
+    with open(path, "rb") as f:
+        data = f.read()
+    # The SHB type reads the same in either byte order
+    if data[:4] != b"\x0a\x0d\x0d\x0a":
+        raise PcapError("not a pcapng file (classic pcap? convert with editcap -F pcapng)")
+    pos, endian, interfaces = 0, "<", []
+    while pos + 12 <= len(data):
+        block_type = struct.unpack_from(endian + "I", data, pos)[0]
+        if block_type == BLOCK_SHB:
+            # A new section may switch byte order, and starts its own interface list
+            magic = struct.unpack_from("<I", data, pos + 8)[0]
+            if magic == BYTE_ORDER_MAGIC:
+                endian = "<"
+            elif magic == struct.unpack(">I", struct.pack("<I", BYTE_ORDER_MAGIC))[0]:
+                endian = ">"
+            else:
+                raise PcapError(f"bad byte-order magic at offset {pos}")
+            interfaces = []
+        length = struct.unpack_from(endian + "I", data, pos + 4)[0]
+        if length < 12 or pos + length > len(data):
+            raise PcapError(f"truncated block at offset {pos}")
+        body = data[pos + 8:pos + length - 4]
+
+        if block_type == BLOCK_IDB:
+            link_type = struct.unpack_from(endian + "H", body, 0)[0]
+            tsresol = _options(body[8:], endian).get(OPT_IF_TSRESOL)
+            interfaces.append((link_type, _ts_unit(tsresol)))
+        elif block_type in (BLOCK_EPB, BLOCK_PB):
+            if block_type == BLOCK_EPB:
+                iface, ts_high, ts_low, captured = struct.unpack_from(endian + "IIII", body, 0)
+            else:
+                iface, _, ts_high, ts_low, captured = struct.unpack_from(endian + "HHIII", body, 0)
+            link_type, unit = interfaces[iface]
+            yield ((ts_high << 32 | ts_low) * unit, link_type, body[20:20 + captured])
+        elif block_type == BLOCK_SPB and interfaces:
+            # No timestamp and the captured length is implied by the snap length
+            original = struct.unpack_from(endian + "I", body, 0)[0]
+            yield (None, interfaces[0][0], body[4:4 + original])
+        pos += length
+
+
+# ---------------- FRAMES -> UDP ----------------
+def _network_layer(link_type, frame):
+    # (ip version, ip packet) or None for anything that is not IP
+    if link_type == LINK_NULL or link_type == LINK_LOOP:
+        family = frame[:4]
+        if link_type == LINK_LOOP:
+            value = struct.unpack(">I", family)[0]
+        else:
+            # Host byte order of whoever captured it: the family fits in one byte
+            value = family[0] if family[0] else family[3]
+        if value == 2:
+            return 4, frame[4:]
+        if value in AF_INET6_NULL:
+            return 6, frame[4:]
+        return None
+    if link_type == LINK_ETHERNET:
+        ethertype, pos = struct.unpack_from("!H", frame, 12)[0], 14
+        while ethertype in (0x8100, 0x88A8):  # VLAN tags
+            ethertype, pos = struct.unpack_from("!H", frame, pos + 2)[0], pos + 4
+        protocol, payload = ethertype, frame[pos:]
+    elif link_type == LINK_SLL:
+        protocol, payload = struct.unpack_from("!H", frame, 14)[0], frame[16:]
+    elif link_type == LINK_SLL2:
+        protocol, payload = struct.unpack_from("!H", frame, 0)[0], frame[20:]
+    elif link_type in LINK_RAW:
+        return (frame[0] >> 4, frame) if frame and frame[0] >> 4 in (4, 6) else None
+    else:
+        return None
+    return {0x0800: (4, payload), 0x86DD: (6, payload)}.get(protocol)
+
+def udp_datagrams(packets, stats=None):
+    # Yields (timestamp, (src ip, src port), (dst ip, dst port), payload) for
+    # every UDP datagram; IP fragments are counted and skipped
+    stats = Counter() if stats is None else stats
+    for ts, link_type, frame in packets:
+        stats["frames"] += 1
+        network = _network_layer(link_type, frame)
+        if network is None:
+            stats["not_ip"] += 1
+            continue
+        version, ip = network
+        if version == 4:
+            header_len = (ip[0] & 0x0F) * 4
+            total_len, flags_offset, protocol = struct.unpack_from("!H2xHxB", ip, 2)
+            if protocol != 17:
+                stats["not_udp"] += 1
+                continue
+            if flags_offset & 0x3FFF:  # more fragments, or not the first one
+                stats["fragments"] += 1
+                continue
+            src, dst = ".".join(map(str, ip[12:16])), ".".join(map(str, ip[16:20]))
+            udp = ip[header_len:total_len]
+        else:
+            if ip[6] != 17:  # extension headers are not followed
+                stats["not_udp"] += 1
+                continue
+            src, dst = _ipv6_text(ip[8:24]), _ipv6_text(ip[24:40])
+            udp = ip[40:40 + struct.unpack_from("!H", ip, 4)[0]]
+        src_port, dst_port, udp_len = struct.unpack_from("!HHH", udp, 0)
+        payload = udp[8:udp_len]
+        if len(payload) != udp_len - 8:
+            stats["truncated"] += 1
+            continue
+        stats["udp"] += 1
+        yield ts, (src, src_port), (dst, dst_port), payload
+
+def _ipv6_text(raw):
+    return ":".join(f"{a:x}" for a in struct.unpack("!8H", raw))
+
+def client_datagrams(path, server_port=SERVER_PORT, stats=None):
+    # The client -> server part of a trace: [(seconds since the first one, client address, payload)]
+    out, start = [], None
+    for ts, src, dst, payload in udp_datagrams(read_pcapng(path), stats):
+        if dst[1] != server_port:
+            if stats is not None and src[1] == server_port:
+                stats["server_datagrams"] += 1
+                stats["server_bytes"] += len(payload)
+            continue
+        ts = ts or 0.0
+        start = ts if start is None else start
+        out.append((ts - start, src, payload))
+    return out
+
+
+# ---------------- REPLAY ----------------
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
+
+def reply_type(data):
+    try:
+        return decode_packet(data).get("msg_type") or "LOBBY"  # lobby packets carry no type
+    except Exception:
+        return "?"
+
+
+class ReplaySocket(asyncio.DatagramProtocol):
+    # Stands in for one captured client address
+    def __init__(self, replayer):
+        self.replayer = replayer
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.replayer.received[reply_type(data)] += 1
+        self.replayer.received_bytes += len(data)
+        self.replayer.last_reply = time.monotonic()
+
+
+def join_span(datagrams):
+    # Trace time of the last "Hello": copies staggered by less than this join
+    # each other's lobbies, and their recorded ACKs stop matching their matches
+    return max((t for t, _, payload in datagrams if payload.startswith(b"Hello")), default=0.0)
+
+def schedule_copies(datagrams, copies=1, stagger=None):
+    # [(trace time, copy, captured address, payload)]; copy k plays the whole
+    # trace again from its own addresses, k * stagger trace-seconds later
+    stagger = join_span(datagrams) + 0.1 if stagger is None else stagger
+    return sorted(((t + k * stagger, k, src, payload) for t, src, payload in datagrams for k in range(copies)),
+                  key=lambda item: item[0])
+
+
+class Replayer:
+    def __init__(self, datagrams, target, speed=1.0, copies=1, stagger=None):
+        # speed: 1 = recorded pace, N = N times faster, 0 = as fast as possible
+        self.target = target
+        self.speed = speed
+        self.schedule = schedule_copies(datagrams, copies, stagger)
+        self.sockets = {}  # (copy, captured address) -> ReplaySocket
+        self.received = Counter()
+        self.received_bytes = 0
+        self.last_reply = None
+        self.lag = []  # how much later than scheduled each datagram went out (s)
+
+    async def open_sockets(self):
+        loop = asyncio.get_running_loop()
+        for _, copy, src, _ in self.schedule:
+            if (copy, src) not in self.sockets:
+                _, sock = await loop.create_datagram_endpoint(lambda: ReplaySocket(self), remote_addr=self.target)
+                self.sockets[(copy, src)] = sock
+
+    async def run(self, settle=SETTLE_SECS):
+        await self.open_sockets()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        sent_bytes = 0
+        for i, (t, copy, src, payload) in enumerate(self.schedule):
+            if self.speed > 0:
+                due = start + t / self.speed
+                if due > loop.time():
+                    await asyncio.sleep(due - loop.time())
+                self.lag.append(max(0.0, loop.time() - due))
+            elif i % 64 == 0:
+                await asyncio.sleep(0)  # let replies in without pacing the sends
+            self.sockets[(copy, src)].transport.sendto(payload)
+            sent_bytes += len(payload)
+        elapsed = loop.time() - start
+        await asyncio.sleep(settle)
+        for sock in self.sockets.values():
+            sock.transport.close()
+        return {"datagrams": len(self.schedule), "bytes": sent_bytes, "seconds": elapsed}
+
+
+def replay_in_process(datagrams, tick_rate, rows, cols, copies=1, stagger=None):
+    # The trace fed straight into a MatchManager with no sockets: datagrams
+    # and ticks interleave as they did in the recording (virtual time), but run
+    # back to back, so the result is the server's own cost for this workload.
+    # Idle matches are reaped on the trace clock, once per second like the
+    # server loops do, and a copy's match is closed after its last datagram
+    # (where the recording ends), so a finished copy stops costing ticks.
+    from match_manager import MatchManager
+    out = Counter()
+
+    def send(data, addr):
+        out["datagrams"] += 1
+        out["bytes"] += len(data)
+        out[reply_type(data)] += 1
+
+    manager = MatchManager(send, max_matches=0, tick_rate=tick_rate, rows=rows, cols=cols)
+    local = {}  # every captured address of every copy gets its own fake port
+    period, next_tick, ticks = 1.0 / tick_rate, 0.0, 0
+    reap_every = max(1, int(tick_rate))
+    handle_time = tick_time = 0.0
+    schedule = schedule_copies(datagrams, copies, stagger)
+    last = {copy: i for i, (_, copy, _, _) in enumerate(schedule)}
+    with contextlib.redirect_stdout(io.StringIO()):  # no "Player connected" per fake client
+        for i, (t, copy, src, payload) in enumerate(schedule):
+            while next_tick <= t:
+                started = time.perf_counter()
+                manager.tick()
+                if ticks % reap_every == 0:
+                    manager.reap_idle(next_tick)
+                tick_time += time.perf_counter() - started
+                next_tick += period
+                ticks += 1
+            addr = local.setdefault((copy, src), ("127.0.0.1", 20000 + len(local)))
+            started = time.perf_counter()
+            manager.handle_datagram(payload, addr, t)
+            handle_time += time.perf_counter() - started
+            match = manager.by_addr.get(addr)
+            if match is not None:
+                match.last_activity = t if last[copy] != i else float("-inf")
+    return {"datagrams": len(datagrams) * copies, "ticks": ticks, "handle_seconds": handle_time,
+            "tick_seconds": tick_time, "out_datagrams": out.pop("datagrams"), "out_bytes": out.pop("bytes"),
+            "out_types": out}
+
+
+# ---------------- SERVER METRICS ----------------
+def server_snapshot(port):
+    # The live server's /metrics.json, None when it is not reachable
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics.json", timeout=2) as response:
+            return json.loads(response.read())
+    except (OSError, ValueError):
+        return None
+
+def server_delta(before, after):
+    # What the server sent and how long its ticks took during the replay
+    def total(snapshot, name):
+        value = snapshot.get(name, 0)
+        return sum(value.values()) if isinstance(value, dict) else value
+    sent = {name: total(after, name) - total(before, name)
+            for name in ("gridclash_packets_sent_total", "gridclash_bytes_sent_total")}
+    ticks = after.get("gridclash_tick_seconds", {})
+    return {"packets": sent["gridclash_packets_sent_total"], "bytes": sent["gridclash_bytes_sent_total"],
+            "ticks": ticks.get("count", 0) - before.get("gridclash_tick_seconds", {}).get("count", 0),
+            "tick_p99_ms": ticks.get("p99", 0) * 1000}
+
+
+def print_trace_info(path, datagrams, stats):
+    clients = Counter(src for _, src, _ in datagrams)
+    kinds = Counter(reply_type(payload) if payload[:1] != b"H" else "Hello" for _, _, payload in datagrams)
+    print(f"{path}: {stats['frames']} frames, {stats['udp']} UDP datagrams"
+          + "".join(f", {stats[k]} {k.replace('_', ' ')}" for k in ("fragments", "not_ip", "not_udp", "truncated") if stats[k]))
+    duration = datagrams[-1][0] if datagrams else 0.0
+    print(f"client -> server: {len(datagrams)} datagrams, {sum(len(p) for _, _, p in datagrams)} bytes "
+          f"over {duration:.1f}s from {len(clients)} clients")
+    print("  " + ", ".join(f"{kind} {n}" for kind, n in kinds.most_common()))
+    for src, n in clients.items():
+        print(f"  {src[0]}:{src[1]:<6} {n} datagrams")
+    print(f"server -> client (recorded): {stats['server_datagrams']} datagrams, {stats['server_bytes']} bytes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay the client side of a Grid Clash pcapng capture")
+    parser.add_argument("trace", nargs="?", default="game-trace.pcapng")
+    parser.add_argument("--trace-port", type=int, default=SERVER_PORT, help="the server's UDP port in the capture")
+    parser.add_argument("--info", action="store_true", help="only describe the trace")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="server to replay against")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="1 = recorded pace, N = N times faster, 0 = as fast as possible")
+    parser.add_argument("--copies", type=int, default=1, help="concurrent copies of the trace, each from its own sockets")
+    parser.add_argument("--stagger", type=float, default=None,
+                        help="trace seconds between the starts of the copies (default: the trace's join span)")
+    parser.add_argument("--in-process", action="store_true",
+                        help="feed a MatchManager directly instead of a server over UDP (deterministic, no sockets)")
+    parser.add_argument("--tick-rate", type=float, default=None,
+                        help="server tick rate (in-process, or spawned server; default the game's rate x --speed)")
+    parser.add_argument("--rows", type=int, default=None)
+    parser.add_argument("--cols", type=int, default=None)
+    parser.add_argument("--spawn-server", action="store_true",
+                        help=f"start {SERVER_SCRIPT} --max-matches 0 on --port for the replay and stop it afterwards")
+    parser.add_argument("--server-args", default="", help="extra arguments for the spawned server")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="the server's --metrics-port, to report what it sent and its tick times (0 = skip)")
+    args = parser.parse_args()
+
+    stats = Counter()
+    try:
+        datagrams = client_datagrams(args.trace, args.trace_port, stats)
+    except (OSError, PcapError) as e:
+        print(f"Cannot read {args.trace}: {e}")
+        sys.exit(1)
+    if args.info or not datagrams:
+        print_trace_info(args.trace, datagrams, stats)
+        sys.exit(0 if datagrams else 1)
+
+    if args.in_process:
+        from match import TICK_RATE, GRID_SIZE
+        tick_rate = args.tick_rate or TICK_RATE
+        result = replay_in_process(datagrams, tick_rate, args.rows or GRID_SIZE, args.cols or GRID_SIZE,
+                                   args.copies, args.stagger)
+        n, busy = result["datagrams"], result["handle_seconds"] + result["tick_seconds"]
+        print(f"In-process replay: {n} datagrams, {result['ticks']} ticks at {tick_rate:g}/s")
+        print(f"  datagrams  {result['handle_seconds'] * 1e6 / n:8.1f} us each  ({n / result['handle_seconds']:,.0f}/s)")
+        print(f"  ticks      {result['tick_seconds'] * 1e6 / max(1, result['ticks']):8.1f} us each")
+        stagger = join_span(datagrams) + 0.1 if args.stagger is None else args.stagger
+        print(f"  total      {busy:.3f}s server time for {datagrams[-1][0] + stagger * (args.copies - 1):.1f}s of trace")
+        print(f"  output     {result['out_datagrams']} datagrams, {result['out_bytes']} bytes  ("
+              + ", ".join(f"{kind} {count}" for kind, count in result["out_types"].most_common()) + ")")
+        sys.exit(0)
+
+    server = None
+    if args.spawn_server:
+        from match import TICK_RATE
+        extra = args.server_args.split()
+        tick_rate = args.tick_rate or (TICK_RATE * args.speed if args.speed > 0 else None)
+        if tick_rate:
+            extra += ["--tick-rate", str(tick_rate)]
+        for flag, value in (("--rows", args.rows), ("--cols", args.cols)):
+            if value:
+                extra += [flag, str(value)]
+        server = subprocess.Popen([sys.executable, SERVER_SCRIPT, "--max-matches", "0", "--port", str(args.port),
+                                   "--metrics-port", str(args.metrics_port), "--metrics-json", ""] + extra,
+                                  stdout=subprocess.DEVNULL)
+        time.sleep(2)
+    try:
+        before = server_snapshot(args.metrics_port) if args.metrics_port else None
+        replayer = Replayer(datagrams, (args.host, args.port), args.speed, args.copies, args.stagger)
+        sent = asyncio.run(replayer.run())
+        after = server_snapshot(args.metrics_port) if args.metrics_port else None
+    except KeyboardInterrupt:
+        print("\nReplay interrupted")
+        sys.exit(1)
+    finally:
+        if server is not None:
+            server.terminate()
+
+    lag = sorted(replayer.lag)
+    mode = "as fast as possible" if args.speed <= 0 else f"{args.speed:g}x"
+    print(f"Replayed {sent['datagrams']} datagrams ({sent['bytes']} bytes) from {len(replayer.sockets)} sockets "
+          f"in {sent['seconds']:.2f}s, {mode}: {sent['datagrams'] / max(sent['seconds'], 1e-9):,.0f} datagrams/s")
+    if args.speed > 0:
+        print(f"  send lag   p50 {percentile(lag, 50) * 1000:.2f}ms  p99 {percentile(lag, 99) * 1000:.2f}ms")
+    received = sum(replayer.received.values())
+    print(f"  replies    {received} datagrams, {replayer.received_bytes} bytes  ("
+          + ", ".join(f"{kind} {n}" for kind, n in replayer.received.most_common()) + ")")
+    if before is not None and after is not None:
+        delta = server_delta(before, after)
+        print(f"  server     sent {delta['packets']} datagrams, {delta['bytes']} bytes over {delta['ticks']} ticks, "
+              f"tick p99 since server start {delta['tick_p99_ms']:.2f}ms")
+    elif args.metrics_port:
+        print(f"  server     no metrics on port {args.metrics_port}")
@@ -0,0 +1,464 @@
+import json
+import math
+import struct
+from grid_encoding import pack_cells, unpack_cells, pack_changes, unpack_changes
+
+# ---------------- WIRE PROTOCOL ----------------
+# Two encodings share the same logical packet (see Packet):
+#   json   - json.dumps(packet.__dict__), the original format
+#   binary - fixed struct header + typed payload body per message type
+# Binary datagrams start with BINARY_MAGIC, which can never be the first byte
+# of a JSON document, so the receiver can tell the two apart without state.
+
+# Bumped whenever a binary header or body layout changes, so a peer built
+# against another layout drops the datagram instead of misreading it.
+# 4: FLAG_BASE deltas, the ACK / EVENT Ack bodies with synced id and hold,
+#    FLAG_ENCODED cell blocks and PING/PONG (3 read all of them wrongly)
+PROTOCOL_VERSION = 4
+BINARY_MAGIC = 0xC7
+
+# Every datagram is kept under this size so it never needs IP fragmentation
+MAX_DATAGRAM = 1200
+RECV_BUFFER = 65535
+# Kernel receive queue asked for on server sockets, so a burst of moves waits
+# there for the next tick instead of being dropped (capped by net.core.rmem_max)
+SOCKET_RCVBUF = 4 * 1024 * 1024
+# Most cells one EVENT may claim (the binary EVENT is then ~550 bytes). JSON
+# moves take up to 4x that, so senders also split any EVENT whose encoding
+# would pass MAX_DATAGRAM (see GameClient.send_moves)
+MAX_EVENT_MOVES = 128
+REASSEMBLY_TIMEOUT = 0.5  # seconds to wait for the missing parts of an update
+
+CODEC_JSON = "json"
+CODEC_BINARY = "binary"
+SUPPORTED_CODECS = [CODEC_BINARY, CODEC_JSON]  # preference order
+
+MSG_LOBBY = 0     # handshake / waiting room ("" msg_type in JSON)
+MSG_SNAPSHOT = 1
+MSG_DELTA = 2
+MSG_INFO = 3
+MSG_ACK = 4
+MSG_EVENT = 5
+MSG_VIEWPORT = 6  # client -> server: the board rectangle it wants updates for
+MSG_PING = 7      # client -> server: clock sync request, carries the client send time
+MSG_PONG = 8      # server -> client: the ping's time plus server receive/send times
+
+MSG_TYPES = {"": MSG_LOBBY, "SNAPSHOT": MSG_SNAPSHOT, "DELTA": MSG_DELTA,
+             "INFO": MSG_INFO, "ACK": MSG_ACK, "EVENT": MSG_EVENT, "VIEWPORT": MSG_VIEWPORT,
+             "PING": MSG_PING, "PONG": MSG_PONG}
+MSG_NAMES = {v: k for k, v in MSG_TYPES.items()}
+
+# magic, version, msg_type, snapshot_id, seq_num, server_timestamp, payload_len
+HEADER = struct.Struct("!BBBiIdH")
+
+FLAG_GAME_ONGOING = 0x01
+FLAG_FRAGMENT = 0x02  # body carries part/parts after the flags byte
+FLAG_PATCH = 0x04     # snapshot covers a rectangle of the board, not all of it
+FLAG_RESULTS = 0x08   # body ends with the move results of the tick
+FLAG_BASE = 0x10      # delta states the snapshot id it is relative to
+FLAG_ENCODED = 0x20   # cells/changes use a grid_encoding block instead of the raw layout
+
+
+class Packet:
+    def __init__(self, version, msg_type, snapshot_id, seq_num, server_timestamp, payload_len, payload):
+        self.version = version
+        self.msg_type = msg_type
+        self.snapshot_id = snapshot_id
+        self.seq_num = seq_num
+        self.server_timestamp = server_timestamp
+        self.payload_len = payload_len
+        self.payload = payload
+
+
+# ---------------- HANDSHAKE ----------------
+def hello_message(codecs=SUPPORTED_CODECS):
+    # "Hello" on its own is what older clients send; they only speak JSON
+    return f"Hello codecs={','.join(codecs)}".encode()
+
+def negotiate_codec(data):
+    try:
+        text = data.decode()
+    except UnicodeDecodeError:
+        return CODEC_JSON
+    offered = []
+    for token in text.split()[1:]:
+        if token.startswith("codecs="):
+            offered = token[len("codecs="):].split(",")
+    for codec in SUPPORTED_CODECS:
+        if codec in offered:
+            return codec
+    return CODEC_JSON
+
+
+# ---------------- PAYLOAD BODIES ----------------
+def _flags(payload):
+    flags = FLAG_GAME_ONGOING if payload.get("gameOngoing") else 0
+    if "Parts" in payload:
+        flags |= FLAG_FRAGMENT
+    if payload.get("Results"):
+        flags |= FLAG_RESULTS
+    if "Base" in payload:
+        flags |= FLAG_BASE
+    return flags
+
+def _pack_head(payload):
+    head = struct.pack("!B", _flags(payload))
+    if "Parts" in payload:
+        head += struct.pack("!HH", payload["Part"], payload["Parts"])
+    return head
+
+def _unpack_head(body):
+    flags = body[0]
+    payload = {"gameOngoing": bool(flags & FLAG_GAME_ONGOING)}
+    if flags & FLAG_FRAGMENT:
+        payload["Part"], payload["Parts"] = struct.unpack_from("!HH", body, 1)
+        return flags, payload, 5
+    return flags, payload, 1
+
+def _pack_str(text):
+    raw = text.encode()
+    return struct.pack("!H", len(raw)) + raw
+
+def _unpack_str(body, offset):
+    (n,) = struct.unpack_from("!H", body, offset)
+    offset += 2
+    return body[offset:offset + n].decode(), offset + n
+
+def _pack_results(payload):
+    # [player, r, c, ok] per move applied this tick
+    results = payload.get("Results")
+    if not results:
+        return b""
+    out = bytearray(struct.pack("!H", len(results)))
+    for pid, r, c, ok in results:
+        out += struct.pack("!BHHB", pid, r, c, ok)
+    return bytes(out)
+
+def _unpack_results(flags, payload, body, offset):
+    if flags & FLAG_RESULTS:
+        (n,) = struct.unpack_from("!H", body, offset)
+        offset += 2
+        payload["Results"] = [list(t) for t in struct.iter_unpack("!BHHB", body[offset:offset + n * 6])]
+    return payload
+
+def _encode_delta(payload):
+    changes = payload.get("Changes", [])
+    raw = bytearray(struct.pack("!H", len(changes)))
+    for r, c, v in changes:
+        raw += struct.pack("!HHB", r, c, v)
+    # Whichever of the raw triples and the gap-encoded form is smaller
+    packed = pack_changes(changes) if changes else None
+    head = _pack_head(payload)
+    if packed is not None and len(packed) < len(raw):
+        head = bytes([head[0] | FLAG_ENCODED]) + head[1:]
+    out = bytearray(head)
+    if "Base" in payload:
+        out += struct.pack("!i", payload["Base"])
+    out += packed if head[0] & FLAG_ENCODED else raw
+    out += _pack_results(payload)
+    return bytes(out)
+
+def _decode_delta(body):
+    flags, payload, offset = _unpack_head(body)
+    if flags & FLAG_BASE:
+        (payload["Base"],) = struct.unpack_from("!i", body, offset)
+        offset += 4
+    if flags & FLAG_ENCODED:
+        payload["Changes"], offset = unpack_changes(body, offset)
+        return _unpack_results(flags, payload, body, offset)
+    (n,) = struct.unpack_from("!H", body, offset)
+    offset += 2
+    payload["Changes"] = [list(t) for t in struct.iter_unpack("!HHB", body[offset:offset + n * 5])]
+    return _unpack_results(flags, payload, body, offset + n * 5)
+
+def _encode_snapshot(payload):
+    grid = payload["Grid"]
+    rows, cols = len(grid), len(grid[0]) if grid else 0
+    r0, c0 = payload.get("Origin", (0, 0))
+    cells = b"".join(bytes(row) for row in grid)
+    packed = pack_cells(cells)
+    head = _pack_head(payload)
+    flags = head[0]
+    if "Origin" in payload:
+        flags |= FLAG_PATCH
+    if len(packed) < len(cells):
+        flags |= FLAG_ENCODED
+    out = bytearray([flags]) + head[1:]
+    out += struct.pack("!HHHH", r0, c0, rows, cols)
+    out += _pack_str(payload.get("Message", ""))
+    out += packed if flags & FLAG_ENCODED else cells
+    out += _pack_results(payload)
+    return bytes(out)
+
+def _decode_snapshot(body):
+    flags, payload, offset = _unpack_head(body)
+    r0, c0, rows, cols = struct.unpack_from("!HHHH", body, offset)
+    message, offset = _unpack_str(body, offset + 8)
+    if flags & FLAG_ENCODED:
+        cells, offset = unpack_cells(body, offset, rows * cols)
+    else:
+        cells, offset = body[offset:offset + rows * cols], offset + rows * cols
+    payload["Grid"] = [list(cells[r * cols:(r + 1) * cols]) for r in range(rows)]
+    if flags & FLAG_PATCH:
+        payload["Origin"] = [r0, c0]
+    if message:
+        payload["Message"] = message
+    return _unpack_results(flags, payload, body, offset)
+
+def _encode_info(payload):
+    head = struct.pack("!BBd", _flags(payload), payload.get("id", 0), payload.get("timestamp", 0.0))
+    return head + _pack_str(payload.get("Message", ""))
+
+def _decode_info(body):
+    flags, pid, ts = struct.unpack_from("!BBd", body, 0)
+    message, _ = _unpack_str(body, 10)
+    return {"Message": message, "gameOngoing": bool(flags & FLAG_GAME_ONGOING), "timestamp": ts, "id": pid}
+
+def _encode_event(payload):
+    # {"Moves": [[x, y], ...], "id": player, "Ack": [latest, bits, synced, hold_ms]}; the old
+    # "x,y,id" string is one move. The piggybacked ACK is optional.
+    if isinstance(payload, str):
+        x, y, pid = map(int, payload.split(","))
+        payload = {"Moves": [[x, y]], "id": pid}
+    moves = payload["Moves"]
+    out = bytearray(struct.pack("!BH", payload["id"], len(moves)))
+    for x, y in moves:
+        out += struct.pack("!HH", x, y)
+    if "Ack" in payload:
+        out += struct.pack("!iIiH", *payload["Ack"])
+    return bytes(out)
+
+def _decode_event(body):
+    pid, n = struct.unpack_from("!BH", body, 0)
+    offset = 3 + n * 4
+    payload = {"Moves": [list(t) for t in struct.iter_unpack("!HH", body[3:offset])], "id": pid}
+    if len(body) >= offset + 14:
+        payload["Ack"] = list(struct.unpack_from("!iIiH", body, offset))
+    return payload
+
+def _encode_viewport(payload):
+    return struct.pack("!HHHH", *payload["Rect"])
+
+def _decode_viewport(body):
+    return {"Rect": list(struct.unpack_from("!HHHH", body, 0))}
+
+def _encode_ack(payload):
+    # The acked id is the header snapshot_id; "Bits" covers the 32 ids before
+    # it, "Synced" is the newest id the client's board is complete up to and
+    # "Hold" the ms the client sat on the acked id before sending this ACK
+    return struct.pack("!IiH", payload.get("Bits", 0), payload.get("Synced", -1), payload.get("Hold", 0))
+
+def _decode_ack(body):
+    # An empty body is a plain ACK from an older client
+    if len(body) < 10:
+        return {}
+    bits, synced, hold = struct.unpack_from("!IiH", body, 0)
+    return {"Bits": bits, "Synced": synced, "Hold": hold}
+
+def _encode_ping(payload):
+    return struct.pack("!d", payload["T1"])
+
+def _decode_ping(body):
+    return {"T1": struct.unpack_from("!d", body, 0)[0]}
+
+def _encode_pong(payload):
+    # T1 = client send (client clock), T2/T3 = server receive/send (server clock)
+    return struct.pack("!ddd", payload["T1"], payload["T2"], payload["T3"])
+
+def _decode_pong(body):
+    t1, t2, t3 = struct.unpack_from("!ddd", body, 0)
+    return {"T1": t1, "T2": t2, "T3": t3}
+
+BODY_CODECS = {
+    MSG_DELTA: (_encode_delta, _decode_delta),
+    MSG_SNAPSHOT: (_encode_snapshot, _decode_snapshot),
+    MSG_INFO: (_encode_info, _decode_info),
+    MSG_EVENT: (_encode_event, _decode_event),
+    MSG_ACK: (_encode_ack, _decode_ack),
+    MSG_VIEWPORT: (_encode_viewport, _decode_viewport),
+    MSG_PING: (_encode_ping, _decode_ping),
+    MSG_PONG: (_encode_pong, _decode_pong),
+}
+
+
+# ---------------- ENCODE / DECODE ----------------
+def encode_packet(packet, codec=CODEC_JSON):
+    msg_type = MSG_TYPES.get(packet.msg_type)
+    # Lobby traffic happens before/while negotiating, so it always stays JSON
+    if codec != CODEC_BINARY or msg_type not in BODY_CODECS:
+        # payload_len is always the real size of the encoded payload
+        body = json.dumps(packet.payload, separators=(',', ':'))
+        head = dict(packet.__dict__, payload_len=len(body))
+        del head["payload"]
+        return (json.dumps(head, separators=(',', ':'))[:-1] + ',"payload":' + body + '}').encode()
+
+    body = BODY_CODECS[msg_type][0](packet.payload)
+    snapshot_id = packet.snapshot_id if isinstance(packet.snapshot_id, int) else -1
+    header = HEADER.pack(BINARY_MAGIC, PROTOCOL_VERSION, msg_type, snapshot_id,
+                         packet.seq_num & 0xFFFFFFFF, packet.server_timestamp, len(body))
+    return header + body
+
+def decode_packet(data):
+    # Returns the same dict shape json.loads() gives for a JSON datagram
+    if not data or data[0] != BINARY_MAGIC:
+        return json.loads(data.decode())
+
+    _, version, msg_type, snapshot_id, seq_num, server_ts, payload_len = HEADER.unpack_from(data, 0)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version {version}")
+    body = data[HEADER.size:HEADER.size + payload_len]
+    payload = BODY_CODECS[msg_type][1](body)
+    return {"version": version, "msg_type": MSG_NAMES[msg_type], "snapshot_id": snapshot_id,
+            "seq_num": seq_num, "server_timestamp": server_ts, "payload_len": payload_len,
+            "payload": payload}
+
+
+# ---------------- CLOCK SYNC ----------------
+_JSON_PING_HEAD = b'{"version":1,"msg_type":"PING"'
+
+def is_ping(data):
+    # Checked before any match logic, without decoding the datagram
+    if data[:1] == bytes([BINARY_MAGIC]):
+        return len(data) > 2 and data[2] == MSG_PING
+    return data.startswith(_JSON_PING_HEAD)
+
+def pong_message(data, received_at, now):
+    # Answers a PING in the codec it came in; `received_at`/`now` are server clock
+    ping = decode_packet(data)
+    codec = CODEC_BINARY if data[0] == BINARY_MAGIC else CODEC_JSON
+    payload = {"T1": ping["payload"]["T1"], "T2": received_at, "T3": now}
+    return encode_packet(Packet(1, "PONG", -1, ping["seq_num"], now, 0, payload), codec)
+
+
+# ---------------- FRAGMENTATION ----------------
+# SNAPSHOT and DELTA packets larger than MAX_DATAGRAM are split into numbered
+# parts ("Part"/"Parts" in the payload). Every part is independently
+# applicable: a snapshot part is a rectangular patch of the board ("Origin" +
+# "Grid") and a delta part is a subset of the changes. A lost part therefore
+# only loses its own cells, never the rest of the update. Move results are
+# not split along with the cells; they travel in trailing DELTA parts that
+# carry no changes.
+
+_PLACEHOLDER_PART = 65535  # widest Part/Parts value, used while sizing parts
+
+def packetize(packet, codec=CODEC_JSON, mtu=MAX_DATAGRAM):
+    data = encode_packet(packet, codec)
+    if len(data) <= mtu or packet.msg_type not in ("SNAPSHOT", "DELTA"):
+        return [data]
+
+    results = packet.payload.get("Results")
+    if results:
+        packet = _with_payload(packet, {k: v for k, v in packet.payload.items() if k != "Results"})
+
+    if packet.msg_type == "DELTA":
+        pieces = [(packet, p) for p in _split_changes(packet, codec, mtu)]
+    else:
+        pieces = [(packet, p) for p in _split_grid(packet, codec, mtu)]
+    if results:
+        pieces.extend(_split_results(packet, results, codec, mtu))
+
+    datagrams = []
+    for part, (base, payload) in enumerate(pieces):
+        payload["Part"], payload["Parts"] = part, len(pieces)
+        datagrams.append(encode_packet(_with_payload(base, payload), codec))
+    return datagrams
+
+def _with_payload(packet, payload):
+    return Packet(packet.version, packet.msg_type, packet.snapshot_id, packet.seq_num,
+                  packet.server_timestamp, packet.payload_len, payload)
+
+def _size(packet, payload, codec):
+    sized = dict(payload, Part=_PLACEHOLDER_PART, Parts=_PLACEHOLDER_PART)
+    return len(encode_packet(_with_payload(packet, sized), codec))
+
+def _chunk(count, estimate, size, mtu):
+    # Greedy ranges of at most `estimate` items, shrunk in proportion to the
+    # measured overshoot until each one fits
+    ranges, start = [], 0
+    while start < count:
+        n = min(estimate, count - start)
+        while n > 1:
+            measured = size(start, n)
+            if measured <= mtu:
+                break
+            n = max(1, min(n - 1, n * mtu // measured))
+        ranges.append((start, n))
+        start += n
+    return ranges
+
+def _split_changes(packet, codec, mtu):
+    changes = packet.payload["Changes"]
+    size = len(encode_packet(packet, codec))
+    estimate = max(1, int(len(changes) * mtu / size))
+
+    def make(start, n):
+        return dict(packet.payload, Changes=changes[start:start + n])
+
+    ranges = _chunk(len(changes), estimate, lambda s, n: _size(packet, make(s, n), codec), mtu)
+    return [make(s, n) for s, n in ranges]
+
+def _split_results(packet, results, codec, mtu):
+    carrier = Packet(packet.version, "DELTA", packet.snapshot_id, packet.seq_num,
+                     packet.server_timestamp, packet.payload_len, {})
+    base = {"Changes": [], "gameOngoing": packet.payload.get("gameOngoing"),
+            "timestamp": packet.payload.get("timestamp")}
+    if "Base" in packet.payload:
+        base["Base"] = packet.payload["Base"]
+
+    def make(start, n):
+        return dict(base, Results=results[start:start + n])
+
+    size = len(encode_packet(_with_payload(carrier, make(0, len(results))), codec))
+    estimate = max(1, int(len(results) * mtu / size))
+    ranges = _chunk(len(results), estimate, lambda s, n: _size(carrier, make(s, n), codec), mtu)
+    return [(carrier, make(s, n)) for s, n in ranges]
+
+def _split_grid(packet, codec, mtu):
+    grid = packet.payload["Grid"]
+    rows, cols = len(grid), len(grid[0])
+    r0, c0 = packet.payload.get("Origin", (0, 0))
+
+    def make(top, height, left, width):
+        sub = [row[left:left + width] for row in grid[top:top + height]]
+        return dict(packet.payload, Grid=sub, Origin=[r0 + top, c0 + left])
+
+    # Column bands only kick in when a single row is wider than a datagram
+    width = cols
+    while width > 1 and _size(packet, make(0, 1, 0, width), codec) > mtu:
+        width = math.ceil(width / 2)
+
+    size = len(encode_packet(_with_payload(packet, make(0, rows, 0, width)), codec))
+    estimate = max(1, int(rows * mtu / size))
+    pieces = []
+    for left in range(0, cols, width):
+        w = min(width, cols - left)
+        ranges = _chunk(rows, estimate, lambda s, n: _size(packet, make(s, n, left, w), codec), mtu)
+        pieces.extend(make(s, n, left, w) for s, n in ranges)
+    return pieces
+
+
+class Reassembler:
+    # Tracks which parts of each fragmented update have arrived. Parts are
+    # applied as they come in; the update only counts as received (and is
+    # ACKed) once every part is there, and is forgotten after `timeout`.
+    def __init__(self, timeout=REASSEMBLY_TIMEOUT):
+        self.timeout = timeout
+        self.pending = {}  # snapshot_id -> (parts, received part numbers, first seen)
+        self.completed = 0
+        self.expired = 0
+
+    def add(self, snapshot_id, part, parts, now):
+        self.expire(now)
+        entry = self.pending.setdefault(snapshot_id, (parts, set(), now))
+        entry[1].add(part)
+        if len(entry[1]) < entry[0]:
+            return False
+        del self.pending[snapshot_id]
+        self.completed += 1
+        return True
+
+    def expire(self, now):
+        stale = [sid for sid, (_, _, first) in self.pending.items() if now - first > self.timeout]
+        for sid in stale:
+            del self.pending[sid]
+        self.expired += len(stale)
@@ -0,0 +1,92 @@
+import math
+import time
+from collections import deque
+
+# ---------------- TICK SCHEDULER ----------------
+# Fixed-rate scheduler on absolute time.monotonic() deadlines. Tick k is due at
+# start + k * interval, so the period does not drift with the time spent
+# diffing and sending. When a tick runs past one or more deadlines the missed
+# ticks are never replayed back to back:
+#   skip     - wait for the next deadline still on the original grid
+#   compress - run one tick immediately (its delta covers the missed ones),
+#              then continue on the original grid
+# Every tick's work time and lateness is recorded so overload is visible.
+
+OVERRUN_POLICIES = ("skip", "compress")
+TICK_LOG_LEN = 12000  # 10 minutes of samples at 20 Hz
+
+
+class TickScheduler:
+    def __init__(self, rate_hz=20, overrun_policy="skip", clock=time.monotonic):
+        if overrun_policy not in OVERRUN_POLICIES:
+            raise ValueError(f"overrun_policy must be one of {OVERRUN_POLICIES}")
+        self.rate_hz = rate_hz
+        self.interval = 1.0 / rate_hz
+        self.overrun_policy = overrun_policy
+        self.clock = clock
+        self.start_time = None
+        self.deadline = None
+        self.tick_started = None
+        self.tick_count = 0
+        self.overruns = 0
+        self.skipped_ticks = 0
+        # (time_since_start_s, work_ms, lateness_ms, overrun)
+        self.tick_log = deque(maxlen=TICK_LOG_LEN)
+
+    def start(self):
+        self.start_time = self.clock()
+        self.deadline = self.start_time
+
+    def begin_tick(self):
+        if self.start_time is None:
+            self.start()
+        self.tick_started = self.clock()
+        return max(0.0, self.tick_started - self.deadline)
+
+    def end_tick(self):
+        now = self.clock()
+        work = now - self.tick_started
+        lateness = max(0.0, self.tick_started - self.deadline)
+
+        self.deadline += self.interval
+        overrun = now > self.deadline
+        if overrun:
+            self.overruns += 1
+            missed = math.floor((now - self.deadline) / self.interval) + 1
+            if self.overrun_policy == "skip":
+                self.deadline += missed * self.interval
+                self.skipped_ticks += missed
+            else:
+                # One immediate tick stands in for all of the missed ones
+                self.deadline += (missed - 1) * self.interval
+                self.skipped_ticks += missed - 1
+
+        self.tick_count += 1
+        self.tick_log.append((self.tick_started - self.start_time, work * 1000, lateness * 1000, overrun))
+
+    def time_until_next(self):
+        return max(0.0, self.deadline - self.clock())
+
+    def wait(self):
+        delay = self.time_until_next()
+        if delay > 0:
+            time.sleep(delay)
+
+    def summary(self):
+        works = sorted(w for _, w, _, _ in self.tick_log)
+        lates = sorted(l for _, _, l, _ in self.tick_log)
+
+        def pct(values, q):
+            return values[min(len(values) - 1, int(q * len(values)))] if values else 0
+
+        return {
+            "Tick rate (Hz)": self.rate_hz,
+            "Ticks": self.tick_count,
+            "Tick overruns": self.overruns,
+            "Skipped ticks": self.skipped_ticks,
+            "Avg tick work (ms)": sum(works) / len(works) if works else 0,
+            "p99 tick work (ms)": pct(works, 0.99),
+            "Max tick work (ms)": works[-1] if works else 0,
+            "Avg tick lateness (ms)": sum(lates) / len(lates) if lates else 0,
+            "p99 tick lateness (ms)": pct(lates, 0.99),
+        }
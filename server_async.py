@@ -0,0 +1,56 @@
+import asyncio
+import socket
+from match import GRID_SIZE
+from match_manager import MatchManager
+from protocol import SOCKET_RCVBUF
+
+# ---------------- ASYNCIO ENGINE ----------------
+# Receive, ACK handling and the tick broadcast all run on one event loop, so the
+# match state is only ever touched from a single thread and nothing polls on a
+# socket timeout. Wire behaviour is identical to the threaded engine.
+
+
+class ServerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, manager):
+        self.manager = manager
+        self.finished = asyncio.Event()
+
+    def connection_made(self, transport):
+        self.manager.send = transport.sendto
+
+    def datagram_received(self, data, addr):
+        self.manager.handle_datagram(data, addr)
+        if self.manager.done:
+            self.finished.set()
+
+
+async def serve(port, scheduler, on_game_over=None, rows=GRID_SIZE, cols=GRID_SIZE, max_matches=1):
+    loop = asyncio.get_running_loop()
+    manager = MatchManager(None, max_matches, on_game_over, scheduler.rate_hz, rows, cols)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF)
+    sock.bind(('0.0.0.0', port))
+    transport, protocol = await loop.create_datagram_endpoint(lambda: ServerProtocol(manager), sock=sock)
+    print(f"Server running on UDP port {port} (asyncio)...")
+    print("Waiting for players...")
+
+    reap_every = max(1, int(scheduler.rate_hz))
+    try:
+        scheduler.start()
+        while not manager.done:
+            scheduler.begin_tick()
+            manager.tick()
+            if scheduler.tick_count % reap_every == 0:
+                manager.reap_idle()
+            scheduler.end_tick()
+            try:
+                await asyncio.wait_for(protocol.finished.wait(), scheduler.time_until_next())
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        transport.close()
+    return manager
+
+
+def run(port, scheduler, on_game_over=None, rows=GRID_SIZE, cols=GRID_SIZE, max_matches=1):
+    return asyncio.run(serve(port, scheduler, on_game_over, rows, cols, max_matches))
@@ -3,12 +3,198 @@ import time
 import sys
 import os
 import signal
+import shutil
+import argparse
+import asyncio
+import random
+import tempfile
+from netem_proxy import SCENARIOS, LISTEN_PORT, SERVER_PORT as PROXIED_SERVER_PORT
+from game_client import GameClient
+from client_metrics import MetricsWriter, WindowedRate
+from load_test import HELLO_RETRY, MOVE_WINDOW_MS
 
 SERVER_SCRIPT = "server+gui+delta.py"
 CLIENT_SCRIPT = "client+gui+delta.py"
+PROXY_SCRIPT = "netem_proxy.py"
 NUM_CLIENTS = 4
+BOT_RATE = 4.0  # clicks per second of each scenario bot
+MATCH_TIMEOUT = 300  # seconds a scenario match may take before the run is cut short
+FINAL_GRACE = 2.0  # seconds the bots keep listening for the final board once the server exits
+# The GUI client's client_metrics columns, so scenario runs compare with the recorded ones
+CLIENT_FIELDS = ["snapshot_id", "seq_num", "time_since_start_ms", "timestamp_epoch_ms", "latency_ms", "jitter_ms",
+                 "perceived_position_error", "mispredictions", "rollback_latency_ms", "bandwidth_per_client_kbps",
+                 "rtt_ms", "clock_offset_ms"]
+SERVER_RESULTS = ["server_metrics.csv", "server_client_metrics.csv", "server_tick_metrics.csv"]
 
-def run_test():
+# With a scenario the server moves to PROXIED_SERVER_PORT and the impairment
+# proxy takes its place on the port the clients use. Instead of GUI windows
+# waiting for someone to click, NUM_CLIENTS headless players (ScenarioBot)
+# play one match, clicking free cells drawn from --seed, so a scenario run
+# needs nobody at the keyboard. Everything the run writes goes straight to
+# <out>/<scenario>/ with the prefix of the recorded folders; the server runs
+# in a scratch folder there, so the CSVs in the working tree are never
+# touched:
+#   python test.py --scenario Loss_2% --seed 7
+
+
+# ---------------- SCENARIO BOTS ----------------
+class ScenarioBot(asyncio.DatagramProtocol):
+    def __init__(self, index, seed, rate, done, out_prefix):
+        self.out_prefix = out_prefix  # <out>/<scenario>/<prefix>
+        self.rng = random.Random(seed * 100003 + index)
+        self.rate = rate
+        self.done = done  # resolved once this player's match is over
+        self.transport = None
+        self.client = GameClient(self.send)
+        self.pending = []  # [r, c] clicked since the last EVENT
+        self.hello_at = 0
+        self.metrics = MetricsWriter(CLIENT_FIELDS)
+        self.bandwidth = WindowedRate()
+        self.start_time = None
+        self.bandwidth_start_time = None
+        self.total_bytes_received = 0
+        self.previous_latency = 0
+
+    def send(self, data):
+        self.transport.sendto(data)
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.connect()
+
+    def connect(self):
+        self.hello_at = time.monotonic()
+        self.client.connect()
+
+    def datagram_received(self, data, addr):
+        now = time.monotonic()
+        self.total_bytes_received += len(data)
+        self.bandwidth.add(len(data), now)
+        if self.start_time is None:
+            self.start_time = now
+            self.bandwidth_start_time = time.time()
+        try:
+            update = self.client.receive(data, now)
+        except Exception:
+            return
+        self.client.maybe_ping(now)
+        if update.pong:
+            return
+        if self.client.my_id is not None:
+            self.metrics.open(f"{self.out_prefix}client_metrics_{self.client.my_id}.csv")
+
+        latency_ms = jitter_ms = 0
+        if update.latency_ms is not None:
+            latency_ms = update.latency_ms
+            jitter_ms = abs(latency_ms - self.previous_latency)
+            self.previous_latency = latency_ms
+        self.client.maybe_ack(now)
+
+        msg = update.msg
+        self.metrics.write({
+            "snapshot_id": msg.get("snapshot_id"),
+            "seq_num": msg.get("seq_num"),
+            "time_since_start_ms": round((now - self.start_time) * 1000, 3),
+            "timestamp_epoch_ms": now * 1000,
+            "latency_ms": round(latency_ms, 3),
+            "jitter_ms": round(jitter_ms, 3),
+            "perceived_position_error": len(update.changed),
+            "mispredictions": 0,  # bots draw no predicted cells
+            "rollback_latency_ms": "",
+            "bandwidth_per_client_kbps": round(self.bandwidth.rate(now) * 8 / 1000, 3),
+            **self.clock_columns()
+        })
+        if self.client.game_over:
+            self.finish()
+
+    def clock_columns(self):
+        clock = self.client.clock.summary()
+        return {"rtt_ms": clock["rtt_ms"] if clock["rtt_ms"] is not None else "",
+                "clock_offset_ms": clock["clock_offset_ms"] if clock["clock_offset_ms"] is not None else ""}
+
+    def finish(self):
+        # Session summary row like the GUI's save_csv
+        if self.done.done():
+            return
+        self.done.set_result(self.client.my_id)
+        duration = time.time() - self.bandwidth_start_time if self.bandwidth_start_time else 0
+        self.metrics.close({
+            "snapshot_id": "", "seq_num": "", "time_since_start_ms": "", "timestamp_epoch_ms": "",
+            "latency_ms": "", "jitter_ms": "", "perceived_position_error": "",
+            "mispredictions": 0, "rollback_latency_ms": 0,
+            "bandwidth_per_client_kbps": self.total_bytes_received * 8 / 1000 / duration if duration > 0 else 0,
+            "rtt_ms": self.client.clock.summary()["min_rtt_ms"] or "",
+            "clock_offset_ms": self.clock_columns()["clock_offset_ms"]
+        })
+
+    # --- CLICKING ---
+    async def play(self):
+        while not self.done.done():
+            await asyncio.sleep(self.rng.expovariate(self.rate))
+            client = self.client
+            if client.my_id is None:
+                if time.monotonic() - self.hello_at > HELLO_RETRY:
+                    self.connect()
+                continue
+            if client.synced_id < 0:
+                continue
+            free = [[r, c] for r in range(client.rows) for c in range(client.cols)
+                    if client.grid[r][c] == 0 and [r, c] not in self.pending]
+            if not free:
+                continue
+            if not self.pending:
+                asyncio.get_running_loop().call_later(MOVE_WINDOW_MS / 1000, self.flush)
+            self.pending.append(self.rng.choice(free))
+
+    def flush(self):
+        if self.pending and not self.done.done():
+            moves, self.pending = self.pending, []
+            self.client.send_moves(moves)
+
+
+async def run_bots(server_process, seed, out_prefix, count=NUM_CLIENTS, rate=BOT_RATE):
+    # Plays one match through the proxy; returns when every bot saw the final
+    # board, or FINAL_GRACE after the server exited, or at MATCH_TIMEOUT
+    loop = asyncio.get_running_loop()
+    bots, tasks = [], []
+    for index in range(count):
+        done = loop.create_future()
+        transport, bot = await loop.create_datagram_endpoint(
+            lambda index=index, done=done: ScenarioBot(index, seed, rate, done, out_prefix),
+            remote_addr=("127.0.0.1", LISTEN_PORT))
+        bots.append(bot)
+        tasks.append(asyncio.create_task(bot.play()))
+    deadline = time.monotonic() + MATCH_TIMEOUT
+    server_gone = None
+    try:
+        while not all(bot.done.done() for bot in bots):
+            if server_gone is None and server_process.poll() is not None:
+                server_gone = time.monotonic()
+            if server_gone is not None and time.monotonic() - server_gone > FINAL_GRACE:
+                break
+            if time.monotonic() > deadline:
+                print("Scenario match timed out.")
+                break
+            await asyncio.sleep(0.2)
+    finally:
+        for bot, task in zip(bots, tasks):
+            bot.finish()
+            task.cancel()
+            bot.transport.close()
+    return [bot.client.my_id for bot in bots]
+
+
+def collect_results(scratch, target, prefix):
+    # Only the server's files from this run's scratch folder are moved
+    for name in SERVER_RESULTS:
+        path = os.path.join(scratch, name)
+        if os.path.exists(path):
+            shutil.move(path, os.path.join(target, prefix + name))
+    shutil.rmtree(scratch, ignore_errors=True)
+    print(f"Results saved to {target}")
+
+
+def run_test(scenario=None, seed=1, out_dir="runs"):
     if not os.path.exists(SERVER_SCRIPT):
         print(f"Error: Server script '{SERVER_SCRIPT}' not found.")
         return
@@ -17,36 +203,56 @@ def run_test():
         return
 
     processes = []
+    server_cwd = os.getcwd()
 
     try:
+        server_args = []
+        if scenario:
+            target = os.path.join(out_dir, scenario)
+            prefix = SCENARIOS[scenario]["prefix"]
+            os.makedirs(target, exist_ok=True)
+            server_cwd = tempfile.mkdtemp(prefix=".server-", dir=target)
+            server_args = ["--port", str(PROXIED_SERVER_PORT)]
+            print(f"Starting impairment proxy ({scenario}, seed {seed})...")
+            log_path = os.path.join(target, prefix + "proxy_log.csv")
+            processes.append(subprocess.Popen(
+                [sys.executable, PROXY_SCRIPT, "--scenario", scenario, "--seed", str(seed), "--log", log_path],
+                cwd=os.getcwd()
+            ))
+
         print(f"Starting Server ({SERVER_SCRIPT})...")
         server_process = subprocess.Popen(
-            [sys.executable, SERVER_SCRIPT],
-            cwd=os.getcwd() 
+            [sys.executable, os.path.abspath(SERVER_SCRIPT)] + server_args,
+            cwd=server_cwd
         )
         processes.append(server_process)
         
         time.sleep(2)
 
-        print(f"Launching {NUM_CLIENTS} Clients...")
-        for i in range(NUM_CLIENTS):
-            print(f"  -> Starting Client {i+1}...")
-            client_process = subprocess.Popen(
-                [sys.executable, CLIENT_SCRIPT],
-                cwd=os.getcwd()
-            )
-            processes.append(client_process)
-            time.sleep(0.5)
+        if scenario:
+            print(f"Playing one match with {NUM_CLIENTS} bots (seed {seed})...")
+            ids = asyncio.run(run_bots(server_process, seed, os.path.join(target, prefix)))
+            print(f"Match finished, players {sorted(i for i in ids if i is not None)} recorded.")
+        else:
+            print(f"Launching {NUM_CLIENTS} Clients...")
+            for i in range(NUM_CLIENTS):
+                print(f"  -> Starting Client {i+1}...")
+                client_process = subprocess.Popen(
+                    [sys.executable, CLIENT_SCRIPT],
+                    cwd=os.getcwd()
+                )
+                processes.append(client_process)
+                time.sleep(0.5)
 
-        print("\nAll components started!")
-        print("The game should begin automatically once all windows are open.")
-        print("Press Ctrl+C in this terminal to close all processes and stop the test.")
+            print("\nAll components started!")
+            print("The game should begin automatically once all windows are open.")
+            print("Press Ctrl+C in this terminal to close all processes and stop the test.")
 
-        while True:
-            if server_process.poll() is not None:
-                print("Server process ended unexpectedly.")
-                break
-            time.sleep(1)
+            while True:
+                if server_process.poll() is not None:
+                    print("Server process ended unexpectedly.")
+                    break
+                time.sleep(1)
 
     except KeyboardInterrupt:
         print("\nStopping test...")
@@ -55,8 +261,17 @@ def run_test():
         for p in processes:
             if p.poll() is None:
                 p.terminate()
+        for p in processes:
+            p.wait()
+        if scenario:
+            collect_results(server_cwd, target, prefix)
                
         print("Test finished.")
 
 if __name__ == "__main__":
-    run_test()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Launch the server and clients, optionally behind the impairment proxy")
+    parser.add_argument("--scenario", choices=list(SCENARIOS), help="reproduce a recorded network scenario")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the proxy's loss/jitter streams and the bots' clicks")
+    parser.add_argument("--out", default="runs", help="where scenario results are collected")
+    args = parser.parse_args()
+    run_test(args.scenario, args.seed, args.out)
\ No newline at end of file